@@ -0,0 +1,453 @@
+import datetime
+import itertools
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+from .server import serve
+
+PAGE_SIZE = 100
+
+# Link fields Airtable keeps in sync on the other table
+INVERSE_LINKS = {
+    ("TPROD_Prints", "Printer"): ("TPROD_Printers", "Prints"),
+    ("TPROD_Prints", "FileToPrint"): ("TPROD_FilesToPrint", "Prints"),
+}
+
+_TOKEN = re.compile(r'\s*(?:(\{[^}]*\})|("(?:[^"\\]|\\.)*")|(!=|[=<>(),])|([\w.]+))')
+
+
+def _tokenize(formula):
+    tokens, pos = [], 0
+    formula = formula.strip()
+    while pos < len(formula):
+        match = _TOKEN.match(formula, pos)
+        if not match:
+            raise ValueError(f"Cannot parse formula at {formula[pos:]!r}")
+        field, string, op, word = match.groups()
+        if field is not None:
+            tokens.append(("field", field[1:-1]))
+        elif string is not None:
+            tokens.append(("value", json.loads(string)))
+        elif op is not None:
+            tokens.append(("op", op))
+        else:
+            tokens.append(("word", word))
+        pos = match.end()
+    return tokens
+
+
+def _text(value):
+    if value is None or value is False or value == []:
+        return ""
+    if value is True:
+        return "1"
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class Formula:
+    """The subset of Airtable formulas pyrtable filters compile to.
+
+    AND, OR, NOT, IS_AFTER, LAST_MODIFIED_TIME, field truthiness and
+    comparisons between fields and literals.
+    """
+
+    FUNCTIONS = {
+        "AND": lambda record, *args: all(args),
+        "OR": lambda record, *args: any(args),
+        "NOT": lambda record, arg: not arg,
+        "TRUE": lambda record: True,
+        "FALSE": lambda record: False,
+        "BLANK": lambda record: "",
+        "IS_AFTER": lambda record, a, b: _date(a) > _date(b),
+        "IS_BEFORE": lambda record, a, b: _date(a) < _date(b),
+        "LAST_MODIFIED_TIME": lambda record: record["modified"],
+    }
+
+    def __init__(self, formula):
+        self.tokens = _tokenize(formula)
+        self.pos = 0
+        self.tree = self.__expression()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Trailing tokens in formula {formula!r}")
+
+    def __peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def __take(self, kind=None, value=None):
+        token = self.__peek()
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            raise ValueError(f"Unexpected token {token}")
+        self.pos += 1
+        return token
+
+    def __expression(self):
+        left = self.__term()
+        kind, op = self.__peek()
+        if kind == "op" and op in ("=", "!=", "<", ">"):
+            self.__take()
+            return ("compare", op, left, self.__term())
+        return left
+
+    def __term(self):
+        kind, value = self.__take()
+        if kind == "field":
+            return ("field", value)
+        if kind == "value":
+            return ("value", value)
+        if kind == "op" and value == "(":
+            node = self.__expression()
+            self.__take("op", ")")
+            return node
+        if kind == "word" and self.__peek() == ("op", "("):
+            self.__take()
+            args = []
+            while self.__peek() != ("op", ")"):
+                args.append(self.__expression())
+                if self.__peek() == ("op", ","):
+                    self.__take()
+            self.__take("op", ")")
+            return ("call", value.upper(), args)
+        if kind == "word":
+            return ("value", float(value))
+        raise ValueError(f"Unexpected token {(kind, value)}")
+
+    def __evaluate(self, node, record):
+        kind = node[0]
+        if kind == "field":
+            return record["fields"].get(node[1])
+        if kind == "value":
+            return node[1]
+        if kind == "call":
+            args = [self.__evaluate(arg, record) for arg in node[2]]
+            return self.FUNCTIONS[node[1]](record, *args)
+        _, op, left, right = node
+        left, right = self.__evaluate(left, record), self.__evaluate(right, record)
+        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+            a, b = left, right
+        else:
+            a, b = _text(left), _text(right)
+        return {
+            "=": a == b,
+            "!=": a != b,
+            "<": a < b,
+            ">": a > b,
+        }[op]
+
+    def __call__(self, record):
+        return bool(self.__evaluate(self.tree, record))
+
+
+class FakeAirtable:
+    """In-memory Airtable bases served over HTTP on localhost.
+
+    Listings are paginated like the real API and, with `rate_limit` set,
+    more than that many requests per second on a base get a 429 and lock
+    the base for `penalty` seconds. Requests are counted per table and
+    method in `calls`.
+    """
+
+    def __init__(self, rate_limit=None, penalty=30, latency=0):
+        self.rate_limit = rate_limit
+        self.penalty = penalty
+        self.latency = latency
+        self.tables = {}
+        self.calls = {}
+        self.throttled = 0
+        self._ids = itertools.count(1)
+        self._windows = {}
+        self._locked_until = {}
+        self._formulas = {}
+        self._lock = threading.RLock()
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://127.0.0.1:{port}/v0"
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"airtable": self})
+        self.server = serve(("127.0.0.1", 0), handler)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.tables = {}
+            self.reset_calls()
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+            self.throttled = 0
+
+    def count(self, table, method):
+        with self._lock:
+            key = f"{method} {table}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def new_id(self):
+        return "rec%014d" % next(self._ids)
+
+    def table(self, base_id, table):
+        return self.tables.setdefault((base_id, table), {})
+
+    def __link(self, base_id, table, record_id, fields, old_fields=None):
+        for field, value in fields.items():
+            inverse = INVERSE_LINKS.get((table, field))
+            if inverse is None:
+                continue
+            other_table, other_field = self.table(base_id, inverse[0]), inverse[1]
+            old = set((old_fields or {}).get(field) or ())
+            new = set(value or ())
+            for other_id in old - new:
+                other = other_table.get(other_id)
+                if other and record_id in other["fields"].get(other_field, []):
+                    other["fields"][other_field].remove(record_id)
+                    other["modified"] = datetime.datetime.now(datetime.timezone.utc)
+            for other_id in new - old:
+                other = other_table.get(other_id)
+                if other is not None:
+                    links = other["fields"].setdefault(other_field, [])
+                    if record_id not in links:
+                        links.append(record_id)
+                    other["modified"] = datetime.datetime.now(datetime.timezone.utc)
+
+    def create(self, base_id, table, fields):
+        with self._lock:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            record = {
+                "id": self.new_id(),
+                "createdTime": now.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "fields": dict(fields),
+                "modified": now,
+            }
+            self.table(base_id, table)[record["id"]] = record
+            self.__link(base_id, table, record["id"], fields)
+            return record
+
+    def age(self, seconds):
+        """Move every record's last modification `seconds` into the past."""
+        with self._lock:
+            for records in self.tables.values():
+                for record in records.values():
+                    record["modified"] -= datetime.timedelta(seconds=seconds)
+
+    def update(self, base_id, table, record_id, fields):
+        with self._lock:
+            record = self.table(base_id, table).get(record_id)
+            if record is None:
+                return None
+            old_fields = dict(record["fields"])
+            record["fields"].update(fields)
+            record["modified"] = datetime.datetime.now(datetime.timezone.utc)
+            self.__link(base_id, table, record_id, fields, old_fields)
+            return record
+
+    def delete(self, base_id, table, record_id):
+        with self._lock:
+            record = self.table(base_id, table).get(record_id)
+            if record is None:
+                return None
+            self.__link(
+                base_id,
+                table,
+                record_id,
+                {field: [] for field in record["fields"]},
+                record["fields"],
+            )
+            return self.table(base_id, table).pop(record_id)
+
+    def formula(self, text):
+        with self._lock:
+            formula = self._formulas.get(text)
+            if formula is None:
+                formula = self._formulas[text] = Formula(text)
+            return formula
+
+    def list(
+        self, base_id, table, formula=None, fields=None, offset=0, page_size=PAGE_SIZE
+    ):
+        """One page of the records matching `formula`, every one without page_size."""
+        with self._lock:
+            records = list(self.table(base_id, table).values())
+        if formula:
+            formula = self.formula(formula)
+            records = [record for record in records if formula(record)]
+        if page_size is None:
+            page_size = len(records)
+        page = records[offset : offset + page_size]
+        response = {"records": [self.render(record, fields) for record in page]}
+        if offset + page_size < len(records):
+            response["offset"] = str(offset + page_size)
+        return response
+
+    @staticmethod
+    def render(record, fields=None):
+        record_fields = record["fields"]
+        if fields:
+            record_fields = {f: v for f, v in record_fields.items() if f in fields}
+        # Airtable leaves empty fields out of its responses
+        record_fields = {
+            f: v for f, v in record_fields.items() if v not in (None, "", [], False)
+        }
+        return {
+            "id": record["id"],
+            "createdTime": record["createdTime"],
+            "fields": record_fields,
+        }
+
+    def admit(self, base_id):
+        """Account one request on the base, False if it gets a 429."""
+        if self.rate_limit is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now < self._locked_until.get(base_id, 0):
+                self.throttled += 1
+                return False
+            window = self._windows.setdefault(base_id, [])
+            while window and now - window[0] > 1:
+                window.pop(0)
+            if len(window) >= self.rate_limit:
+                self._locked_until[base_id] = now + self.penalty
+                self.throttled += 1
+                return False
+            window.append(now)
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    airtable = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, status, body=None):
+        data = json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def __route(self, method):
+        url = urllib.parse.urlparse(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.split("/") if part]
+        if len(parts) not in (3, 4) or parts[0] != "v0":
+            return self.__reply(404, {"error": "NOT_FOUND"})
+        base_id, table = parts[1], parts[2]
+        record_id = parts[3] if len(parts) == 4 else None
+        body = self.__body() if method in ("POST", "PATCH") else None
+
+        airtable = self.airtable
+        airtable.count(table, method)
+        if airtable.latency:
+            time.sleep(airtable.latency)
+        if not airtable.admit(base_id):
+            return self.__reply(
+                429,
+                {
+                    "errors": [
+                        {
+                            "error": "RATE_LIMIT_REACHED",
+                            "message": "Rate limit exceeded",
+                        }
+                    ]
+                },
+            )
+
+        if method == "GET" and record_id is None:
+            params = urllib.parse.parse_qs(url.query)
+            try:
+                response = airtable.list(
+                    base_id,
+                    table,
+                    formula=params.get("filterByFormula", [None])[0],
+                    fields=set(params.get("fields[]", [])),
+                    offset=int(params.get("offset", [0])[0]),
+                    page_size=min(
+                        int(params.get("pageSize", [PAGE_SIZE])[0]), PAGE_SIZE
+                    ),
+                )
+            except ValueError as e:
+                return self.__reply(
+                    422, {"error": {"type": "INVALID_FILTER", "message": str(e)}}
+                )
+            return self.__reply(200, response)
+
+        if method == "GET":
+            record = airtable.table(base_id, table).get(record_id)
+            if record is None:
+                return self.__reply(404, {"error": "NOT_FOUND"})
+            return self.__reply(200, airtable.render(record))
+
+        if method == "POST":
+            if "records" in body:
+                records = [
+                    airtable.create(base_id, table, item.get("fields", {}))
+                    for item in body["records"]
+                ]
+                return self.__reply(
+                    200, {"records": [airtable.render(r) for r in records]}
+                )
+            record = airtable.create(base_id, table, body.get("fields", {}))
+            return self.__reply(200, airtable.render(record))
+
+        if method == "PATCH":
+            if record_id is None:
+                records = [
+                    airtable.update(base_id, table, item["id"], item.get("fields", {}))
+                    for item in body.get("records", [])
+                ]
+                if None in records:
+                    return self.__reply(404, {"error": "NOT_FOUND"})
+                return self.__reply(
+                    200, {"records": [airtable.render(r) for r in records]}
+                )
+            record = airtable.update(base_id, table, record_id, body.get("fields", {}))
+            if record is None:
+                return self.__reply(404, {"error": "NOT_FOUND"})
+            return self.__reply(200, airtable.render(record))
+
+        if method == "DELETE":
+            record = airtable.delete(base_id, table, record_id)
+            if record is None:
+                return self.__reply(404, {"error": "NOT_FOUND"})
+            return self.__reply(200, {"id": record_id, "deleted": True})
+
+        return self.__reply(405, {"error": "METHOD_NOT_ALLOWED"})
+
+    def do_GET(self):
+        self.__route("GET")
+
+    def do_POST(self):
+        self.__route("POST")
+
+    def do_PATCH(self):
+        self.__route("PATCH")
+
+    def do_DELETE(self):
+        self.__route("DELETE")
@@ -0,0 +1,356 @@
+import base64
+import email.parser
+import hashlib
+import json
+import random
+import select
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+from .server import serve
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Seconds between two looks at the state of a pushing printer
+PUSH_INTERVAL = 0.02
+
+
+class FakePrinter:
+    """State of one fake OctoPrint instance.
+
+    `latency` (plus up to `jitter`) seconds are added to every request,
+    `state` is the connection state text and an unreachable printer answers
+    503. A started print goes back to Operational after `print_seconds`.
+    Every state change is pushed on the open websockets while `push` is
+    set, drop_push() closes them.
+    """
+
+    def __init__(self, api_key, state="Operational", latency=0, jitter=0):
+        self.api_key = api_key
+        self.state = state
+        self.latency = latency
+        self.jitter = jitter
+        self.unreachable = False
+        self.print_seconds = None
+        self.printing_since = None
+        self.folders = set()
+        self.files = {}
+        self.uploaded_bytes = 0
+        self.push = True
+        # Bumped to close the open websockets
+        self.push_generation = 0
+        self.lock = threading.Lock()
+
+    def current_state(self):
+        with self.lock:
+            if (
+                self.printing_since is not None
+                and self.print_seconds is not None
+                and time.monotonic() - self.printing_since >= self.print_seconds
+            ):
+                self.state = "Operational"
+                self.printing_since = None
+            return self.state
+
+    def drop_push(self, refuse=True):
+        """Close the open websockets, and refuse new ones with `refuse`."""
+        with self.lock:
+            self.push = not refuse
+            self.push_generation += 1
+
+    def start_print(self):
+        with self.lock:
+            self.state = "Printing"
+            self.printing_since = time.monotonic()
+
+    def add_file(self, path, size):
+        with self.lock:
+            self.files[path] = {
+                "name": path.rsplit("/", 1)[-1],
+                "path": path,
+                "display": path.rsplit("/", 1)[-1],
+                "type": "machinecode",
+                "typePath": ["machinecode", "gcode"],
+                "origin": "local",
+                "size": size,
+                "date": int(time.time()),
+            }
+
+    def listing(self, folder=None):
+        with self.lock:
+            if folder is None:
+                entries = [
+                    {"name": name, "path": name, "type": "folder", "origin": "local"}
+                    for name in sorted(self.folders)
+                ]
+                return entries + [f for p, f in self.files.items() if "/" not in p]
+            return [
+                dict(f)
+                for path, f in self.files.items()
+                if path.rsplit("/", 1)[0] == folder and "/" in path
+            ]
+
+
+class FakeOctoPrint:
+    """Any number of fake OctoPrint instances behind one local HTTP server.
+
+    Requests are routed to printers by X-Api-Key, and websockets by the
+    session in their auth message. Every printer gets a URL
+    on its own loopback address, the farm keeps one HTTP session per host
+    like it does with real printers. Requests are counted per printer and
+    endpoint in `calls`.
+    """
+
+    def __init__(self):
+        self.printers = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"octoprint": self})
+        self.server = serve(("0.0.0.0", 0), handler)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_printer(self, api_key, **kwargs):
+        printer = FakePrinter(api_key, **kwargs)
+        self.printers[api_key] = printer
+        return printer
+
+    def url_for(self, index):
+        # 127.0.0.0/8 is loopback, each printer gets a host of its own
+        index += 2
+        return f"http://127.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}:{self.port}"
+
+    def reset(self):
+        with self._lock:
+            self.printers = {}
+            self.calls = {}
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    def count(self, api_key, endpoint):
+        with self._lock:
+            calls = self.calls.setdefault(api_key, {})
+            calls[endpoint] = calls.get(endpoint, 0) + 1
+
+    def totals(self):
+        totals = {}
+        with self._lock:
+            for calls in self.calls.values():
+                for endpoint, count in calls.items():
+                    totals[endpoint] = totals.get(endpoint, 0) + count
+        return totals
+
+
+def _read_frame(rfile):
+    """(opcode, payload) of the next websocket frame, (None, b"") at the end."""
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None, b""
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(rfile.read(length)))
+    return header[0] & 0x0F, payload
+
+
+def _frame(opcode, payload=b""):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 2**16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _parse_multipart(content_type, body):
+    message = email.parser.BytesParser().parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    fields, files = {}, {}
+    for part in message.get_payload():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename is not None:
+            files[name] = (filename, payload)
+        else:
+            fields[name] = payload.decode()
+    return fields, files
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    octoprint = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, status, body=None):
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    break
+                chunks.append(chunk)
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def __push(self):
+        """OctoPrint's SockJS websocket, sending the state on every change.
+
+        The socket carries no API key, the printer is known from the auth
+        message sent after a passive login.
+        """
+        self.close_connection = True
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", base64.b64encode(accept).decode())
+        self.end_headers()
+
+        opcode, payload = _read_frame(self.rfile)
+        auth = json.loads(payload or b"{}").get("auth", "") if opcode == 1 else ""
+        printer = self.octoprint.printers.get(auth.split(":", 1)[-1])
+        if printer is None or not printer.push or printer.unreachable:
+            self.wfile.write(_frame(0x8))
+            return
+        self.octoprint.count(printer.api_key, "WS /sockjs/websocket")
+
+        generation = printer.push_generation
+        sent = None
+        while printer.push_generation == generation and not printer.unreachable:
+            state = printer.current_state()
+            if state != sent:
+                message = {"current": {"state": {"text": state}}}
+                self.wfile.write(_frame(0x1, json.dumps(message).encode()))
+                sent = state
+            readable, _, _ = select.select([self.connection], [], [], PUSH_INTERVAL)
+            if readable:
+                opcode, payload = _read_frame(self.rfile)
+                if opcode is None or opcode == 0x8:
+                    return
+                if opcode == 0x9:
+                    self.wfile.write(_frame(0xA, payload))
+        # Dropped without a close frame, as a lost connection
+
+    def __route(self, method):
+        url = urllib.parse.urlparse(self.path)
+        path = urllib.parse.unquote(url.path)
+        if method == "GET" and path == "/sockjs/websocket":
+            return self.__push()
+        body = self.__body() if method == "POST" else b""
+
+        printer = self.octoprint.printers.get(self.headers.get("X-Api-Key"))
+        if printer is None:
+            return self.__reply(403, {"error": "Invalid API key"})
+        endpoint = path if not path.startswith("/api/files/") else "/api/files/*"
+        self.octoprint.count(printer.api_key, f"{method} {endpoint}")
+
+        if printer.latency or printer.jitter:
+            time.sleep(printer.latency + random.uniform(0, printer.jitter))
+        if printer.unreachable:
+            return self.__reply(503, {"error": "Unreachable"})
+
+        if method == "GET" and path == "/api/version":
+            return self.__reply(200, {"api": "0.1", "server": "1.8.0", "text": "fake"})
+        if method == "GET" and path == "/api/connection":
+            return self.__reply(
+                200, {"current": {"state": printer.current_state()}, "options": {}}
+            )
+        if method == "POST" and path == "/api/login":
+            return self.__reply(
+                200, {"name": "_api", "session": printer.api_key, "active": True}
+            )
+        if method == "GET" and path == "/api/files":
+            return self.__reply(200, {"files": printer.listing(), "free": 2**34})
+
+        if not path.startswith("/api/files/local"):
+            return self.__reply(404, {"error": "Not found"})
+        location = path[len("/api/files/local") :].strip("/")
+
+        if method == "GET":
+            if location not in printer.folders:
+                return self.__reply(404, {"error": "Not found"})
+            return self.__reply(
+                200,
+                {
+                    "name": location,
+                    "path": location,
+                    "type": "folder",
+                    "children": printer.listing(location),
+                },
+            )
+
+        if method == "DELETE":
+            with printer.lock:
+                printer.files.pop(location, None)
+            return self.__reply(204)
+
+        if method == "POST" and location:
+            command = json.loads(body or b"{}")
+            if location not in printer.files:
+                return self.__reply(404, {"error": "Not found"})
+            if command.get("command") == "select" and command.get("print"):
+                printer.start_print()
+            return self.__reply(204)
+
+        if method == "POST":
+            fields, files = _parse_multipart(self.headers["Content-Type"], body)
+            if "foldername" in fields:
+                with printer.lock:
+                    printer.folders.add(fields["foldername"])
+                return self.__reply(201, {"done": True})
+            filename, data = files["file"]
+            folder = fields.get("path", "").strip("/")
+            remote_path = f"{folder}/{filename}" if folder else filename
+            printer.add_file(remote_path, len(data))
+            printer.uploaded_bytes += len(data)
+            if fields.get("print") == "true":
+                printer.start_print()
+            return self.__reply(
+                201, {"done": True, "files": {"local": {"path": remote_path}}}
+            )
+
+        return self.__reply(405, {"error": "Method not allowed"})
+
+    def do_GET(self):
+        self.__route("GET")
+
+    def do_POST(self):
+        self.__route("POST")
+
+    def do_DELETE(self):
+        self.__route("DELETE")
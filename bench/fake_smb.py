@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+from smb.base import SharedDevice, SharedFile
+from smb.smb_structs import OperationFailure
+
+ATTR_DIRECTORY = 0x10
+ATTR_NORMAL = 0x80
+CHUNK_SIZE = 64 * 1024
+
+
+class FakeNAS:
+    """Directory standing in for the NAS, every share is the same folder.
+
+    `latency` seconds are added to every call and reads are throttled to
+    `bandwidth` bytes per second when it is set. Calls are counted per
+    method in `calls`.
+    """
+
+    def __init__(self, root, share="gcodes", latency=0, bandwidth=None):
+        self.root = root
+        self.share = share
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = {}
+        self.bytes_read = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def count(self, method, nbytes=0):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.bytes_read += nbytes
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+            self.bytes_read = 0
+            self.connections = 0
+
+    def path(self, path):
+        return os.path.join(self.root, path.replace("\\", "/").lstrip("/"))
+
+    def connection_class(self):
+        """SMBConnection replacement bound to this NAS."""
+        nas = self
+
+        class FakeSMBConnection:
+            def __init__(self, username, password, my_name, remote_name, **kwargs):
+                self.connected = False
+
+            def connect(self, ip, port=139, sock_family=None, timeout=60):
+                nas.count("connect")
+                with nas._lock:
+                    nas.connections += 1
+                self.connected = True
+                return True
+
+            def close(self):
+                self.connected = False
+
+            def echo(self, data, timeout=10):
+                nas.count("echo")
+                return data
+
+            def listShares(self, timeout=30):
+                nas.count("listShares")
+                return [SharedDevice(0, nas.share, "")]
+
+            def __shared_file(self, path):
+                try:
+                    stat = os.stat(nas.path(path))
+                except FileNotFoundError:
+                    raise OperationFailure(f"Unable to open {path}", [])
+                attributes = ATTR_DIRECTORY if os.path.isdir(nas.path(path)) else 0
+                return SharedFile(
+                    stat.st_ctime,
+                    stat.st_atime,
+                    stat.st_mtime,
+                    stat.st_mtime,
+                    stat.st_size,
+                    stat.st_size,
+                    attributes or ATTR_NORMAL,
+                    "",
+                    os.path.basename(path.rstrip("/")),
+                )
+
+            def listPath(self, service_name, path, timeout=30, **kwargs):
+                nas.count("listPath")
+                try:
+                    names = os.listdir(nas.path(path))
+                except FileNotFoundError:
+                    raise OperationFailure(f"Unable to list {path}", [])
+                return [self.__shared_file(os.path.join(path, n)) for n in names]
+
+            def getAttributes(self, service_name, path, timeout=30):
+                nas.count("getAttributes")
+                return self.__shared_file(path)
+
+            def retrieveFile(self, service_name, path, file_obj, timeout=30, **kwargs):
+                try:
+                    f = open(nas.path(path), "rb")
+                except FileNotFoundError:
+                    raise OperationFailure(f"Unable to open {path}", [])
+                size = 0
+                with f:
+                    while True:
+                        chunk = f.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if nas.bandwidth:
+                            time.sleep(len(chunk) / nas.bandwidth)
+                        file_obj.write(chunk)
+                        size += len(chunk)
+                nas.count("retrieveFile", size)
+                return ATTR_NORMAL, size
+
+        return FakeSMBConnection
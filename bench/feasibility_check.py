@@ -0,0 +1,146 @@
+"""Check the feasibility matrix against Printer.can_print.
+
+    python -m bench.feasibility_check
+
+Loads a seeded farm, then for every round draws new filament lengths,
+gcode sizes, filament profiles and filament left, and compares every
+(printer, file) cell of Feasibility with Printer.can_print. Some weights
+fall on a half cent, where rounding methods disagree, and some filament
+left is exactly the weight a file needs. Exits with status 1 on a mismatch.
+"""
+
+import argparse
+import math
+import random
+import shutil
+import sys
+import tempfile
+
+from .run import BASE_ID, REMOTE_DIR, Bench, configure
+from .scenario import Scenario
+
+
+def _set(record, attr_name, value):
+    # Read-only fields too, the records are never saved
+    record._fields_values[attr_name] = value
+
+
+def shuffle_farm(rng, printers, printqueue):
+    """New figures for the records in memory, nothing is saved."""
+    filament_profiles = {}
+    for printer in printers:
+        filament = printer.record.filament
+        if not printer.record.group and filament:
+            filament_profiles[filament.profile.id] = filament.profile
+    for filament_profile in filament_profiles.values():
+        _set(filament_profile, "diameter", rng.choice([1.75, 2.85, 3]))
+        _set(filament_profile, "density", rng.choice([1.04, 1.24, 1.27, 1.3]))
+
+    printfiles = {}
+    for ftp in printqueue:
+        for printfile in ftp.print_model.get_gcodes_by_profile().values():
+            printfiles[printfile.id] = printfile
+    for printfile in printfiles.values():
+        if filament_profiles and rng.random() < 0.5:
+            # A weight on a half cent for one filament profile, where rounding
+            # by a scaling to cents and round() often disagree
+            filament_profile = rng.choice(list(filament_profiles.values()))
+            area = math.pi * (filament_profile.diameter / 2) ** 2
+            weight = rng.randint(100, 100000) / 100 + 0.005
+            filament_used = weight / (area * filament_profile.density)
+        else:
+            filament_used = round(rng.uniform(0.1, 40), rng.choice([1, 2, 5]))
+        _set(printfile, "filament_used", filament_used)
+        profile = printfile.printer_profile
+        # Around the bed size, some gcodes do not fit
+        _set(printfile, "size_x", rng.randint(profile.size_x - 20, profile.size_x + 5))
+        _set(printfile, "size_y", rng.randint(profile.size_y - 20, profile.size_y + 5))
+        _set(printfile, "size_z", rng.randint(profile.size_z - 20, profile.size_z + 5))
+
+    for printer in printers:
+        filament = printer.record.filament
+        if printer.record.group or not filament:
+            continue
+        fitting = [
+            ftp
+            for ftp in printqueue
+            if ftp.color == filament.profile.color and not ftp.printer_group
+        ]
+        printfile = None
+        if fitting:
+            printfile = rng.choice(fitting).print_model.get_gcode_for_printer_profile(
+                printer.record.profile
+            )
+        if printfile and rng.random() < 0.6:
+            # Exactly enough, or a hundredth of a gram off
+            weight = printfile.get_weight_used(filament.profile)
+            _set(filament, "weight_remaining", weight + rng.choice([0, 0, -0.01, 0.01]))
+        else:
+            _set(filament, "weight_remaining", round(rng.uniform(0, 1000), 2))
+
+
+def check(bench, printers, files, rounds, seed):
+    """Run the rounds, returns the mismatches as printable lines."""
+    from farm.farm import Farm
+    from farm.feasibility import Feasibility
+
+    scenario = Scenario(printers, files, random_seed=seed)
+    bench.airtable.reset()
+    bench.octoprint.reset()
+    scenario.seed(bench.airtable, BASE_ID, bench.octoprint)
+    scenario.write_gcodes(bench.nas.root, REMOTE_DIR)
+
+    farm = Farm()
+    printqueue = list(farm.printqueue)
+    rng = random.Random(seed)
+    mismatches = []
+    try:
+        for _ in range(rounds):
+            shuffle_farm(rng, farm.printers, printqueue)
+            feasibility = Feasibility(farm.printers, printqueue)
+            for printer in farm.printers:
+                row = feasibility.row(printer)
+                for position, ftp in enumerate(printqueue):
+                    expected = bool(printer.can_print(ftp))
+                    if bool(row[position]) != expected:
+                        mismatches.append(
+                            f"{printer.record.name} / {ftp.name}:"
+                            f" matrix {bool(row[position])}, can_print {expected}"
+                        )
+    finally:
+        farm.smb.close()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--printers", type=int, default=50)
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.rate_limit = None
+    args.penalty = 0
+    args.airtable_rate = None
+    args.smb_latency = 0
+    args.octoprint_latency = 0
+
+    workdir = tempfile.mkdtemp(prefix="farm-feasibility-")
+    configure(workdir, args)
+    bench = Bench(workdir, args)
+    try:
+        mismatches = check(bench, args.printers, args.files, args.rounds, args.seed)
+    finally:
+        bench.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for mismatch in mismatches[:20]:
+        print(f"MISMATCH {mismatch}", file=sys.stderr)
+    if mismatches:
+        print(f"{len(mismatches)} mismatches", file=sys.stderr)
+        sys.exit(1)
+    print("feasibility matrix matches can_print")
+
+
+if __name__ == "__main__":
+    main()
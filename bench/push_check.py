@@ -0,0 +1,118 @@
+"""Check the push listener against the fake OctoPrint websocket.
+
+    python -m bench.push_check
+
+Watches a small farm, then checks that a pushed state change sets the
+`changed` event, that a dropped socket makes the printer not live and
+that such a printer is polled again by refresh_printers_async while the
+live ones are not. Exits with status 1 when a check fails.
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from .run import BASE_ID, REMOTE_DIR, Bench, configure
+from .scenario import Scenario
+
+POLL = "GET /api/connection"
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def check(bench, printers, timeout):
+    """Run the checks, returns the failures as printable lines."""
+    from farm.farm import Farm
+
+    scenario = Scenario(printers, 10)
+    bench.airtable.reset()
+    bench.octoprint.reset()
+    scenario.seed(bench.airtable, BASE_ID, bench.octoprint)
+    scenario.write_gcodes(bench.nas.root, REMOTE_DIR)
+
+    farm = Farm()
+    changed = threading.Event()
+    farm.start_push(changed)
+    failures = []
+    try:
+        records = [printer.record for printer in farm.printers]
+        if not wait_for(lambda: all(farm.push.is_live(r.id) for r in records), timeout):
+            return ["the printers did not all get live"]
+
+        # A pushed state change wakes the farm up
+        record = next(r for r in records if farm.push.state(r.id) == "Operational")
+        fake = bench.octoprint.printers[record.octoprint_api_key]
+        changed.clear()
+        fake.start_print()
+        if not changed.wait(timeout):
+            failures.append("a state change did not set changed")
+        elif farm.push.state(record.id) != "Printing":
+            failures.append(f"pushed state is {farm.push.state(record.id)!r}")
+
+        # A dropped socket is polled again, the live printers are not
+        changed.clear()
+        fake.drop_push()
+        if not wait_for(lambda: not farm.push.is_live(record.id), timeout):
+            failures.append("a dropped socket stayed live")
+        if not changed.is_set():
+            failures.append("a dropped socket did not set changed")
+
+        bench.reset_calls()
+        farm.refresh_printers_async()
+        for r in records:
+            polls = bench.octoprint.calls.get(r.octoprint_api_key, {}).get(POLL, 0)
+            expected = 1 if r is record else 0
+            if polls != expected:
+                failures.append(f"{r.name} polled {polls} times, not {expected}")
+        if record.status.value != "Printing":
+            failures.append(f"polled printer is {record.status.value}")
+    finally:
+        farm.close()
+        farm.smb.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--printers", type=int, default=5)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=5,
+        help="seconds to wait for each pushed change",
+    )
+    args = parser.parse_args()
+    args.rate_limit = None
+    args.penalty = 0
+    args.airtable_rate = None
+    args.smb_latency = 0
+    args.octoprint_latency = 0
+
+    workdir = tempfile.mkdtemp(prefix="farm-push-")
+    configure(workdir, args)
+    bench = Bench(workdir, args)
+    try:
+        failures = check(bench, args.printers, args.timeout)
+    finally:
+        bench.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("push listener ok")
+
+
+if __name__ == "__main__":
+    main()
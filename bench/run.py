@@ -0,0 +1,296 @@
+"""Benchmark the farm against local stand-ins for Airtable, OctoPrint and the NAS.
+
+    python -m bench.run --printers 10,100 --files 100,1000 --output bench.json
+    python -m bench.run --printers 10,100 --files 100,1000 --baseline bench.json
+
+Every repeat seeds a new farm and times each phase, the report gives the
+latency percentiles of every phase and the requests it sent to each
+backend. With --baseline the run exits with status 1 when a phase got
+slower or sends more requests than in the baseline report.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from .fake_airtable import FakeAirtable
+from .fake_octoprint import FakeOctoPrint
+from .fake_smb import FakeNAS
+from .scenario import Scenario
+
+BASE_ID = "appBENCHMARK00000"
+API_KEY = "keyBENCHMARK00000"
+SMB_SHARE = "farm"
+REMOTE_DIR = "gcodes"
+PHASES = [
+    "init",
+    "refresh_printers",
+    "refresh_printers_async",
+    "refresh",
+    "match",
+    "launch",
+]
+
+
+def configure(workdir, args):
+    """Point the farm at the fakes, before anything from farm is imported."""
+    config_dir = os.path.join(workdir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, "airtable_secrets.yaml"), "w") as f:
+        f.write(f"{BASE_ID}: {API_KEY}\n")
+
+    os.environ.update(
+        {
+            "BASE_ID": BASE_ID,
+            "CONFIG_DIR": config_dir,
+            "LOCAL_GCODES_FOLDER_PATH": os.path.join(workdir, "local"),
+            "REMOTE_GCODES_FOLDER_PATH": REMOTE_DIR,
+            "SMB_SHARE": SMB_SHARE,
+            "SMB_HOST": "nas.invalid",
+            "SMB_USERID": "bench",
+            "SMB_PASSWD": "bench",
+            "AIRTABLE_JOURNAL_PATH": os.path.join(workdir, "journal.jsonl"),
+            "OCTOPRINT_PUSH": "false",
+        }
+    )
+    if args.airtable_rate is not None:
+        os.environ["AIRTABLE_REQUESTS_PER_SECOND"] = str(args.airtable_rate)
+        os.environ["AIRTABLE_BURST"] = str(max(1, int(args.airtable_rate)))
+    if args.rate_limit is not None:
+        os.environ["AIRTABLE_PENALTY_SECONDS"] = str(args.penalty)
+
+
+def percentile(values, p):
+    # Nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Bench:
+    def __init__(self, workdir, args):
+        self.workdir = workdir
+        self.args = args
+        self.airtable = FakeAirtable(
+            rate_limit=args.rate_limit, penalty=args.penalty
+        ).start()
+        self.octoprint = FakeOctoPrint().start()
+        self.nas = FakeNAS(
+            os.path.join(workdir, "nas"),
+            share=SMB_SHARE,
+            latency=args.smb_latency,
+        )
+
+        import pyrtable._baseandtable
+        import smb.SMBConnection
+
+        pyrtable._baseandtable._BaseAndTableProtocol._API_ROOT_URL = self.airtable.url
+        # The farm imports SMBConnection when it connects to the NAS
+        smb.SMBConnection.SMBConnection = self.nas.connection_class()
+
+    def stop(self):
+        self.airtable.stop()
+        self.octoprint.stop()
+
+    def reset_calls(self):
+        self.airtable.reset_calls()
+        self.octoprint.reset_calls()
+        self.nas.reset_calls()
+
+    def calls(self):
+        return {
+            "airtable": dict(sorted(self.airtable.calls.items())),
+            "airtable_throttled": self.airtable.throttled,
+            "octoprint": dict(sorted(self.octoprint.totals().items())),
+            "smb": dict(sorted(self.nas.calls.items())),
+            "smb_bytes": self.nas.bytes_read,
+        }
+
+    def phase(self, results, name, func):
+        self.reset_calls()
+        started = time.perf_counter()
+        value = func()
+        results[name] = {"seconds": time.perf_counter() - started, **self.calls()}
+        return value
+
+    def run_once(self, scenario):
+        from farm.farm import Farm
+        from farm.model.print import PrintRecord
+
+        self.airtable.reset()
+        self.octoprint.reset()
+        scenario.seed(
+            self.airtable, BASE_ID, self.octoprint, latency=self.args.octoprint_latency
+        )
+        scenario.write_gcodes(self.nas.root, REMOTE_DIR)
+        # A real base was not entirely edited in the last minute
+        self.airtable.age(3600)
+        shutil.rmtree(os.path.join(Farm.GCODES_DIR, "cache"), ignore_errors=True)
+        PrintRecord.reset_active_index()
+
+        results = {}
+        farm = self.phase(results, "init", Farm)
+        self.phase(results, "refresh_printers", farm.refresh_printers)
+        self.phase(results, "refresh_printers_async", farm.refresh_printers_async)
+        self.phase(results, "refresh", farm.refresh)
+        matched = self.phase(
+            results,
+            "match",
+            lambda: (
+                list(farm.match_printer_printqueue()),
+                list(farm.match_printer_printqueue_group()),
+            ),
+        )
+
+        def launch():
+            farm.launch_matched(matched[0])
+            farm.launch_matched(matched[1])
+
+        self.phase(results, "launch", launch)
+        results["launch"]["launched"] = len(farm.launched_prints)
+        results["match"]["matched"] = len(matched[0]) + len(matched[1])
+        farm.close()
+        farm.smb.close()
+        return results
+
+    def run(self, scenario, repeat):
+        runs = [self.run_once(scenario) for _ in range(repeat)]
+        report = {}
+        for name in PHASES:
+            seconds = [run[name]["seconds"] for run in runs]
+            # Request counts are the same on every repeat but for coalescing
+            last = runs[-1][name]
+            report[name] = {
+                "p50": percentile(seconds, 50),
+                "p90": percentile(seconds, 90),
+                "p99": percentile(seconds, 99),
+                "max": max(seconds),
+                **{k: v for k, v in last.items() if k != "seconds"},
+            }
+            report[name]["requests"] = sum(last["airtable"].values()) + sum(
+                last["octoprint"].values()
+            )
+        return report
+
+
+def compare(report, baseline, tolerance, min_delta):
+    """Regressions of `report` against `baseline`, as printable lines."""
+    regressions = []
+    for scenario, phases in report.items():
+        for name, phase in phases.items():
+            base = baseline.get(scenario, {}).get(name)
+            if base is None:
+                continue
+            if (
+                phase["p50"] > base["p50"] * (1 + tolerance)
+                and phase["p50"] - base["p50"] > min_delta
+            ):
+                regressions.append(
+                    f"{scenario} {name}: p50 {phase['p50']:.3f}s"
+                    f" (baseline {base['p50']:.3f}s)"
+                )
+            if phase["requests"] > base["requests"] * (1 + tolerance):
+                regressions.append(
+                    f"{scenario} {name}: {phase['requests']} requests"
+                    f" (baseline {base['requests']})"
+                )
+    return regressions
+
+
+def print_report(report):
+    print(
+        f"{'scenario':<14}{'phase':<24}{'p50':>9}{'p90':>9}{'p99':>9}{'requests':>10}"
+    )
+    for scenario, phases in report.items():
+        for name, phase in phases.items():
+            print(
+                f"{scenario:<14}{name:<24}{phase['p50']:>9.3f}{phase['p90']:>9.3f}"
+                f"{phase['p99']:>9.3f}{phase['requests']:>10}"
+            )
+
+
+def sizes(value):
+    return [int(size) for size in value.split(",") if size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--printers", type=sizes, default=[10, 100, 1000])
+    parser.add_argument("--files", type=sizes, default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--octoprint-latency",
+        type=float,
+        default=0.02,
+        help="seconds added to every OctoPrint request",
+    )
+    parser.add_argument(
+        "--smb-latency",
+        type=float,
+        default=0.005,
+        help="seconds added to every SMB call",
+    )
+    parser.add_argument(
+        "--airtable-rate",
+        type=float,
+        default=None,
+        help="requests per second the farm sends to Airtable, 5 by default",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=None,
+        help="answer 429 above this many Airtable requests per second",
+    )
+    parser.add_argument("--penalty", type=float, default=30)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown or request increase over the baseline",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.05,
+        help="slowdowns under this many seconds are never regressions",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="farm-bench-")
+    configure(workdir, args)
+    bench = Bench(workdir, args)
+    report = {}
+    try:
+        for printers in args.printers:
+            for files in args.files:
+                scenario = Scenario(printers, files)
+                print(f"Running {scenario.name}...", file=sys.stderr)
+                report[scenario.name] = bench.run(scenario, args.repeat)
+    finally:
+        bench.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
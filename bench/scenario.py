@@ -0,0 +1,200 @@
+import os
+import random
+
+PROFILES = [
+    ("Prusa MK3S", "mk3s", (250, 210, 210)),
+    ("Ender 3", "ender3", (220, 220, 250)),
+    ("Prusa Mini", "mini", (180, 180, 180)),
+]
+GROUPS = ["Group A", "Group B"]
+COLORS = ["Dark Grey", "Blue", "White", "Orange", "Green", "Yellow", "Red"]
+PRIORITIES = ["Normal", "Medium", "High", "+High", "++High"]
+
+
+class Scenario:
+    """A farm of `printers` printers with `files` files waiting to be printed.
+
+    One in ten printers belongs to a printer group, one in ten is printing
+    and the others are ready. Print models are shared between files, each
+    with gcodes on the NAS for one to three printer profiles.
+    """
+
+    def __init__(self, printers, files, random_seed=0, gcode_bytes=16 * 1024):
+        self.printers = printers
+        self.files = files
+        self.random_seed = random_seed
+        self.gcode_bytes = gcode_bytes
+        self.models = max(10, min(files // 10, 2000))
+        # Record ids, once seeded
+        self.model_ids = []
+        self.group_ids = []
+
+    @property
+    def name(self):
+        return f"{self.printers}p-{self.files}f"
+
+    def write_gcodes(self, nas_root, remote_dir):
+        """Write the gcodes on the fake NAS, left in place between runs."""
+        rng = random.Random(self.random_seed)
+        content = b"G1 X10 Y10 E0.5\n" * (self.gcode_bytes // 16)
+        for m in range(self.models):
+            for _, slug, _ in rng.sample(PROFILES, rng.randint(1, len(PROFILES))):
+                path = os.path.join(
+                    nas_root, remote_dir, slug, f"model{m}_{slug}.gcode"
+                )
+                if os.path.exists(path):
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(content)
+
+    def file_fields(self, rng, name, in_group=False):
+        fields = {
+            "Name": name,
+            "Priority": rng.choice(PRIORITIES),
+            "Color": rng.choice(COLORS),
+            "PrintModel": [rng.choice(self.model_ids)],
+        }
+        if in_group:
+            fields["PrinterGroup"] = [rng.choice(self.group_ids)]
+        return fields
+
+    def seed(self, airtable, base_id, octoprint=None, latency=0):
+        """Fill the fake Airtable base and register the fake printers."""
+        rng = random.Random(self.random_seed)
+        # Drawn apart, the gcodes on the NAS follow the draws of rng
+        durations = random.Random(self.random_seed + 1)
+
+        def create(table, fields):
+            return airtable.create(base_id, table, fields)["id"]
+
+        profiles = {}
+        for name, slug, (x, y, z) in PROFILES:
+            profiles[slug] = create(
+                "TPROD_PrinterProfiles",
+                {
+                    "Name": name,
+                    "Slug": slug,
+                    "Size x": x,
+                    "Size y": y,
+                    "Size z": z,
+                    "Gcode Flavor": "Marlin",
+                },
+            )
+        groups = [create("TPROD_PrinterGroups", {"Name": name}) for name in GROUPS]
+        self.group_ids = groups
+        filament_profiles = {
+            color: create(
+                "TPROD_FilamentProfiles",
+                {
+                    "Name": f"PLA {color}",
+                    "Color": color,
+                    "Material": "PLA",
+                    "Weight [g]": 1000,
+                    "Diameter [mm]": 1.75,
+                    "Density [g/cm3]": 1.24,
+                },
+            )
+            for color in COLORS
+        }
+
+        # Same draws as write_gcodes, so every printfile has its gcode
+        models = []
+        slugs = []
+        for m in range(self.models):
+            gcodes = []
+            slugs.append(set())
+            for _, slug, (x, y, z) in rng.sample(
+                PROFILES, rng.randint(1, len(PROFILES))
+            ):
+                slugs[-1].add(slug)
+                gcodes.append(
+                    create(
+                        "TPROD_PrintFiles",
+                        {
+                            "Name": f"model{m}_{slug}.gcode",
+                            "Time": durations.randint(1800, 6 * 3600),
+                            "Filament used": 2.5,
+                            "Size x": x // 2,
+                            "Size y": y // 2,
+                            "Size z": z // 2,
+                            "Printer Profile": [profiles[slug]],
+                        },
+                    )
+                )
+            models.append(gcodes)
+        models = [
+            create(
+                "TPROD_PrintModel",
+                {
+                    "Name": f"model{m}",
+                    "PrintTime": rng.randint(600, 36000),
+                    "Gcodes": gcodes,
+                },
+            )
+            for m, gcodes in enumerate(models)
+        ]
+        self.model_ids = models
+
+        for i in range(self.printers):
+            in_group = i % 10 == 9
+            printing = i % 10 == 4
+            fields = {
+                "Name": f"printer{i}",
+                "Status": "Printing" if printing else "Operational",
+                "Printer URL": octoprint.url_for(i) if octoprint else None,
+                "Octoprint API Key": f"key{i}",
+                "Automated": True,
+                "Clean Plate": not printing,
+                "PrinterProfile": [profiles[PROFILES[i % len(PROFILES)][1]]],
+            }
+            if in_group:
+                fields["PrinterGroup"] = [groups[i % len(groups)]]
+            printer_id = create("TPROD_Printers", fields)
+            if octoprint is not None:
+                fake = octoprint.add_printer(
+                    f"key{i}", state=fields["Status"], latency=latency
+                )
+                fake.folders.add("3DFP")
+            if not in_group:
+                filament_id = create(
+                    "TPROD_Filaments",
+                    {
+                        "Name": f"filament{i}",
+                        "Weight remaining": 1000,
+                        "FilamentProfile": [filament_profiles[rng.choice(COLORS)]],
+                        "Printer": [printer_id],
+                    },
+                )
+                airtable.update(
+                    base_id, "TPROD_Printers", printer_id, {"Filament": [filament_id]}
+                )
+            if printing:
+                # A model the printer has a gcode for
+                slug = PROFILES[i % len(PROFILES)][1]
+                model_id = rng.choice(
+                    [model for model, s in zip(models, slugs) if slug in s]
+                )
+                ftp_id = create(
+                    "TPROD_FilesToPrint",
+                    {
+                        "Name": f"printing{i}",
+                        "Priority": "Normal",
+                        "Color": "White",
+                        "PrintModel": [model_id],
+                    },
+                )
+                create(
+                    "TPROD_Prints",
+                    {
+                        "State": "In Progress",
+                        "Printer": [printer_id],
+                        "FileToPrint": [ftp_id],
+                    },
+                )
+
+        for j in range(self.files):
+            create(
+                "TPROD_FilesToPrint",
+                self.file_fields(rng, f"file{j}", in_group=j % 20 == 19),
+            )
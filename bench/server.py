@@ -0,0 +1,14 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The farm opens a connection from every printer thread at once
+    request_queue_size = 1024
+
+
+def serve(address, handler):
+    server = Server(address, handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
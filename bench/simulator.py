@@ -0,0 +1,510 @@
+"""Discrete-event simulation of the farm, to compare scheduling policies offline.
+
+    python -m bench.simulator --printers 50 --files 2000 --days 7
+    python -m bench.simulator --printers 50 --files 2000 --days 7 --matching assignment
+
+Printers run the real status transitions (Printer.update_status), filament
+accounting (FilamentRecord.used), matching and launch code (Farm) on an
+in-memory Airtable base, against simulated time: prints last their gcode
+Time, operators harvest after a random delay and some prints fail. The
+report gives plate utilization, idle gaps of ready printers, queue wait
+per priority and the filament used.
+"""
+
+import argparse
+import collections
+import heapq
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from .fake_airtable import FakeAirtable
+from .scenario import Scenario
+
+BASE_ID = "appSIMULATION0000"
+
+
+def configure():
+    """Environment of the simulated farm, before anything from farm is imported."""
+    os.environ["BASE_ID"] = BASE_ID
+    os.environ["OCTOPRINT_PUSH"] = "false"
+    os.environ.pop("METRICS_JSONL_PATH", None)
+    os.environ.pop("METRICS_PORT", None)
+
+
+def percentile(values, p):
+    # Nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def build(store):
+    """The farm classes bound to the in-memory `store`, imported lazily."""
+    from farm.farm import Farm
+    from farm.model.context import AirtableContext
+    from farm.model.printer import Printer
+    from farm.model.snapshot import Snapshot
+
+    class StoreContext(AirtableContext):
+        """AirtableContext reading and writing the FakeAirtable store directly."""
+
+        def fetch_single(self, *, record_cls, record_id, base_and_table):
+            data = store.table(base_and_table.base_id, base_and_table.table_id).get(
+                record_id
+            )
+            if data is None:
+                raise KeyError(record_id)
+            record = record_cls(
+                _base_id=base_and_table.base_id, _table_id=base_and_table.table_id
+            )
+            record.consume_airtable_data(store.render(data))
+            return record
+
+        def fetch_many(self, *, record_cls, base_and_table, record_filter=None):
+            fields = getattr(base_and_table, "fields", None)
+            formula = record_filter.build_formula(record_cls) if record_filter else None
+            response = store.list(
+                base_and_table.base_id,
+                base_and_table.table_id,
+                formula=formula,
+                fields=set(record_cls.get_column_names_for(fields)),
+                page_size=None,
+            )
+            for data in response["records"]:
+                record = record_cls(
+                    _base_id=base_and_table.base_id, _table_id=base_and_table.table_id
+                )
+                record.consume_airtable_data(data)
+                if fields is not None:
+                    record._projection = fields
+                yield record
+
+        def _create(self, record_cls, record):
+            data = store.create(
+                record.base_id, record.table_id, record.encode_to_airtable()
+            )
+            record.consume_airtable_data(store.render(data))
+
+        def _update(self, record_cls, record):
+            dirty_fields = record.encode_to_airtable()
+            if dirty_fields:
+                store.update(record.base_id, record.table_id, record.id, dirty_fields)
+            record._clear_dirty_fields()
+
+        def delete_id(self, *, record_cls, record_id, base_and_table):
+            store.delete(base_and_table.base_id, base_and_table.table_id, record_id)
+
+    class SimulationSnapshot(Snapshot, StoreContext):
+        pass
+
+    class SimulatedOctoprint:
+        def __init__(self, state):
+            self.current = state
+
+        def state(self):
+            return self.current
+
+        def files(self, location=None, recursive=False):
+            if location:
+                return {"children": []}
+            return {"files": [{"name": Printer.UPLOAD_DIR, "type": "folder"}]}
+
+        def new_folder(self, folder_name, location="local"):
+            pass
+
+    class SimulatedPrinter(Printer):
+        def __init__(self, record):
+            self.simulated_state = record.status.value
+            super().__init__(record)
+
+        def create_octoprint_connection(self):
+            self.octoprint = SimulatedOctoprint(self.simulated_state)
+            self.update_status(self.octoprint.state())
+            return True
+
+    class SimulatedFarm(Farm):
+        """Farm matching and launching on simulated printers, with no backends."""
+
+        SMB_REMOTE_PATH = ""
+
+        def __init__(self, snapshot, printers, printqueue, simulation):
+            self.snapshot = snapshot
+            self.printers = printers
+            self.printers_by_id = {printer.record.id: printer for printer in printers}
+            self.printqueue = printqueue
+            self.simulation = simulation
+            self.launched_prints = []
+            self.transfers = []
+            self.staging = None
+            self.push = None
+            self._event_loop = None
+            self.launch_slots = {
+                stage: threading.BoundedSemaphore(1)
+                for stage in ("fetch", "upload", "record")
+            }
+
+        def get_nas_attributes(self, remote_path):
+            return argparse.Namespace(file_size=0)
+
+        def upload_gcode(self, printer, remote_path, filename, attributes=None):
+            return self.simulation.start_print(printer, remote_path)
+
+    return SimulationSnapshot, SimulatedPrinter, SimulatedFarm
+
+
+class Simulation:
+    """Event loop driving a simulated farm.
+
+    The farm runs a cycle (printer refresh, then matching and launch) at the
+    first daemon tick after anything changed: a file queued, a print ended
+    or a plate harvested.
+    """
+
+    def __init__(
+        self,
+        scenario,
+        days=7,
+        interval=60,
+        matching="greedy",
+        harvest_minutes=30,
+        failure_rate=0.05,
+        refill_below=100,
+        arrivals_per_hour=0,
+        history=None,
+        random_seed=0,
+    ):
+        self.scenario = scenario
+        self.duration = days * 86400
+        self.interval = interval
+        self.matching = matching
+        self.harvest_minutes = harvest_minutes
+        self.failure_rate = failure_rate
+        self.refill_below = refill_below
+        self.arrivals_per_hour = arrivals_per_hour
+        self.history = history or []
+        self.rng = random.Random(random_seed)
+
+        self.now = 0
+        self.events = []
+        self.sequence = 0
+        self.tick_at = None
+
+        self.arrived = {}
+        self.waits = collections.defaultdict(list)
+        self.printing = collections.defaultdict(float)
+        self.running = {}
+        self.harvesting = set()
+        self.ready_since = {}
+        self.idle_gaps = []
+        self.filament_used = collections.defaultdict(float)
+        self.launched = 0
+        self.finished = 0
+        self.failed = 0
+
+    def schedule(self, at, handler, *args):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, handler, args))
+
+    def request_tick(self):
+        at = (self.now // self.interval + 1) * self.interval
+        if self.tick_at is None or at < self.tick_at:
+            self.tick_at = at
+            self.schedule(at, self.tick)
+
+    def setup(self):
+        from farm.model.file_to_print import FileToPrintRecord
+        from farm.model.filament import FilamentRecord, FilamentProfileRecord
+        from farm.model.print import PrintRecord
+        from farm.model.print_model import PrintModelRecord
+        from farm.model.printer import (
+            PrinterRecord,
+            PrinterProfileRecord,
+            PrinterGroupRecord,
+        )
+        from farm.model.printfile import PrintFileRecord
+        from farm.printqueue import PrintQueue
+        from pyrtable.context import set_default_context
+
+        self.store = FakeAirtable()
+        self.scenario.seed(self.store, BASE_ID)
+        SimulationSnapshot, SimulatedPrinter, SimulatedFarm = build(self.store)
+
+        self.snapshot = SimulationSnapshot()
+        set_default_context(self.snapshot)
+        self.snapshot.load(
+            [
+                PrinterRecord,
+                PrinterProfileRecord,
+                PrinterGroupRecord,
+                FilamentRecord,
+                FilamentProfileRecord,
+                PrintModelRecord,
+                PrintFileRecord,
+            ]
+        )
+        PrintRecord.reset_active_index()
+        self.printfiles = {
+            f"{printfile.printer_profile.slug}/{printfile.name}": printfile
+            for printfile in PrintFileRecord.objects.all()
+        }
+
+        printers = [SimulatedPrinter(record) for record in PrinterRecord.get_all()]
+        printqueue = PrintQueue(FileToPrintRecord.get_next_files())
+        for ftp in printqueue._entries.values():
+            self.arrived[ftp[1].id] = 0
+        self.farm = SimulatedFarm(self.snapshot, printers, printqueue, self)
+        self.farm.MATCHING_MODE = self.matching
+
+        # Prints already running end at some point of their gcode time
+        for printer in printers:
+            if printer.is_printing():
+                self.schedule(
+                    self.rng.uniform(0, 4 * 3600), self.end_print, printer, False
+                )
+                self.running[printer.record.id] = (None, False, 0)
+
+        for at, fields in self.history:
+            self.schedule(at, self.arrive, fields)
+        if self.arrivals_per_hour:
+            self.schedule(self.next_arrival(), self.arrive, None)
+        self.request_tick()
+
+    def next_arrival(self):
+        return self.now + self.rng.expovariate(self.arrivals_per_hour / 3600)
+
+    def arrive(self, fields):
+        from farm.model.file_to_print import FileToPrintRecord
+
+        if fields is None:
+            fields = self.scenario.file_fields(
+                self.rng, f"arrival{self.sequence}", in_group=self.rng.random() < 0.05
+            )
+            self.schedule(self.next_arrival(), self.arrive, None)
+        data = self.store.create(BASE_ID, "TPROD_FilesToPrint", fields)
+        ftp = FileToPrintRecord.objects.get(data["id"])
+        self.arrived[ftp.id] = self.now
+        self.farm.printqueue.add(ftp)
+        self.request_tick()
+
+    def start_print(self, printer, remote_path):
+        printfile = self.printfiles[remote_path]
+        duration = printfile.time or 3600
+        failed = self.rng.random() < self.failure_rate
+        if failed:
+            duration *= self.rng.uniform(0.05, 0.95)
+        printer.octoprint.current = "Printing"
+        self.running[printer.record.id] = (None, failed, self.now)
+        self.schedule(self.now + duration, self.end_print, printer, failed)
+        return True
+
+    def end_print(self, printer, failed):
+        _, _, started = self.running[printer.record.id]
+        self.printing[printer.record.id] += self.now - started
+        printer.octoprint.current = "Operational"
+        if failed:
+            self.failed += 1
+        else:
+            self.finished += 1
+        self.request_tick()
+
+    def harvest(self, printer):
+        from farm.model.print import State
+        from farm.model.printer import Status
+
+        self.harvesting.discard(printer.record.id)
+        print_, failed, _ = self.running.pop(printer.record.id, (None, False, 0))
+        if failed and print_ is not None:
+            # The operator marks the print failed and queues the file again
+            ftp = print_.file_to_print
+            print_.state = State.FAILED
+            print_.file_to_print = None
+            print_.save()
+            self.arrived[ftp.id] = self.now
+            self.farm.printqueue.add(ftp)
+
+        filament = printer.record.filament
+        if filament and filament.weight_remaining < self.refill_below:
+            filament.weight_remaining = filament.profile.weight or 1000
+            filament.save()
+        printer.record.clean_plate = True
+        printer.set_status(Status.OPERATIONAL)
+        self.request_tick()
+
+    def tick(self):
+        self.tick_at = None
+        for printer in self.farm.printers:
+            filament = printer.record.filament
+            before = filament.weight_remaining if filament else None
+            printer.refresh_status()
+            if filament and filament.weight_remaining < before:
+                self.filament_used[filament.profile.color.value] += (
+                    before - filament.weight_remaining
+                )
+            if printer.is_harvest() and printer.record.id not in self.harvesting:
+                self.harvesting.add(printer.record.id)
+                delay = self.rng.expovariate(1 / (self.harvest_minutes * 60))
+                self.schedule(self.now + delay, self.harvest, printer)
+
+        ready = {
+            printer.record.id
+            for printer in self.farm.get_ready_printers()
+            + self.farm.get_ready_printers_in_group()
+        }
+        for record_id in ready:
+            self.ready_since.setdefault(record_id, self.now)
+
+        matched = list(self.farm.match_printer_printqueue())
+        matched += list(self.farm.match_printer_printqueue_group())
+        for printer, ftp in matched:
+            launched = self.farm.launch_single_print(ftp, printer)
+            if launched is None:
+                continue
+            print_, _ = launched
+            self.farm.printqueue.remove(ftp.id)
+            self.launched += 1
+            _, failed, started = self.running[printer.record.id]
+            self.running[printer.record.id] = (print_, failed, started)
+            priority = ftp.priority.value if ftp.priority else "None"
+            self.waits[priority].append(self.now - self.arrived.pop(ftp.id, 0))
+            since = self.ready_since.pop(printer.record.id, None)
+            if since is not None:
+                self.idle_gaps.append(self.now - since)
+        self.snapshot.flush()
+
+    def run(self):
+        started = time.perf_counter()
+        self.setup()
+        while self.events and self.events[0][0] <= self.duration:
+            self.now, _, handler, args = heapq.heappop(self.events)
+            handler(*args)
+        self.now = self.duration
+        return self.report(time.perf_counter() - started)
+
+    def report(self, wall_seconds):
+        printers = self.farm.printers
+        # Prints still running at the end
+        for record_id, (_, _, started) in self.running.items():
+            if self.farm.printers_by_id[record_id].octoprint.current == "Printing":
+                self.printing[record_id] += self.duration - started
+        utilization = [
+            self.printing[printer.record.id] / self.duration for printer in printers
+        ]
+        idle_gaps = self.idle_gaps + [
+            self.duration - since for since in self.ready_since.values()
+        ]
+
+        waiting = collections.Counter()
+        for ftp in self.farm.printqueue._entries.values():
+            priority = ftp[1].priority.value if ftp[1].priority else "None"
+            waiting[priority] += 1
+
+        def hours(values, p):
+            value = percentile(values, p)
+            return None if value is None else round(value / 3600, 2)
+
+        return {
+            "scenario": self.scenario.name,
+            "matching": self.matching,
+            "days": self.duration / 86400,
+            "wall_seconds": round(wall_seconds, 2),
+            "prints": {
+                "launched": self.launched,
+                "finished": self.finished,
+                "failed": self.failed,
+            },
+            "plate_utilization": {
+                "mean": round(sum(utilization) / len(utilization), 4),
+                "min": round(min(utilization), 4),
+                "max": round(max(utilization), 4),
+            },
+            "idle_gaps_hours": {
+                "count": len(idle_gaps),
+                "p50": hours(idle_gaps, 50),
+                "p90": hours(idle_gaps, 90),
+                "max": hours(idle_gaps, 100),
+                "total": round(sum(idle_gaps) / 3600, 1),
+            },
+            "queue_wait_hours": {
+                priority: {
+                    "launched": len(self.waits.get(priority, [])),
+                    "p50": hours(self.waits.get(priority, []), 50),
+                    "p90": hours(self.waits.get(priority, []), 90),
+                    "still_queued": waiting.get(priority, 0),
+                }
+                for priority in sorted(set(self.waits) | set(waiting))
+            },
+            "filament_grams": {
+                "total": round(sum(self.filament_used.values()), 1),
+                "by_color": {
+                    color: round(grams, 1)
+                    for color, grams in sorted(self.filament_used.items())
+                },
+            },
+        }
+
+
+def load_history(path):
+    """(seconds, FilesToPrint fields) arrivals from a JSON-lines file.
+
+    Every line has "at" in seconds from the start and the Airtable fields of
+    the file to print.
+    """
+    history = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                history.append((float(entry["at"]), entry["fields"]))
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--printers", type=int, default=50)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--interval", type=float, default=60)
+    parser.add_argument(
+        "--matching", choices=["greedy", "assignment"], default="greedy"
+    )
+    parser.add_argument("--harvest-minutes", type=float, default=30)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument(
+        "--refill-below",
+        type=float,
+        default=100,
+        help="grams under which the spool is replaced at harvest",
+    )
+    parser.add_argument("--arrivals-per-hour", type=float, default=10)
+    parser.add_argument("--history", help="JSON-lines arrivals to replay")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    configure()
+    simulation = Simulation(
+        Scenario(args.printers, args.files, random_seed=args.seed),
+        days=args.days,
+        interval=args.interval,
+        matching=args.matching,
+        harvest_minutes=args.harvest_minutes,
+        failure_rate=args.failure_rate,
+        refill_below=args.refill_below,
+        arrivals_per_hour=args.arrivals_per_hour,
+        history=load_history(args.history) if args.history else None,
+        random_seed=args.seed,
+    )
+    report = simulation.run()
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import math
+import sys
+import time
+
+from .matcher import Matcher
+from .printqueue import PRIORITY_RANK
+
+
+class TimeBudgetExceeded(Exception):
+    pass
+
+
+def hungarian(cost, deadline=None):
+    """Minimum cost assignment of every row of `cost` to a distinct column.
+
+    Rows cannot outnumber columns. Returns {row: column}, raises
+    TimeBudgetExceeded once time.monotonic() passes `deadline`.
+    """
+    n, m = len(cost), len(cost[0])
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    # p[j]: row assigned to column j, 1-based, 0 when free
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [math.inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeBudgetExceeded()
+            used[j0] = True
+            i0 = p[j0]
+            row, ui0 = cost[i0 - 1], u[i0]
+            delta, j1 = math.inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = row[j - 1] - ui0 - v[j]
+                    if current < minv[j]:
+                        minv[j] = current
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    return {p[j] - 1: j - 1 for j in range(1, m + 1) if p[j]}
+
+
+class Assigner:
+    """Printer/file matching solved as a maximum weight bipartite matching.
+
+    The greedy Matcher lets a printer take a file another printer needed
+    more, the assignment places the files of the highest priority first,
+    then as many files as possible, then the longest prints. Compatibility
+    comes from the Matcher's Feasibility matrix. Past `time_budget` seconds
+    the greedy Matcher is used instead.
+    """
+
+    def __init__(self, printqueue, time_budget=2.0):
+        self.printqueue = list(printqueue)
+        self.time_budget = time_budget
+        self.matcher = Matcher(self.printqueue)
+
+    def weights(self, positions, printers_count):
+        """Integer weights ranking by priority, count, print time, queue order.
+
+        Every level is scaled past the largest total the levels below can
+        reach with `printers_count` files, a file of a higher priority is
+        worth more than any number of files of lower priorities.
+        """
+        ftps = [self.printqueue[position] for position in positions]
+        print_times = [
+            (ftp.print_model.print_time or 0) if ftp.print_model else 0 for ftp in ftps
+        ]
+        queue_unit = len(self.printqueue) + 1
+        time_unit = (printers_count + 1) * (max(print_times, default=0) + 1)
+        rank_unit = printers_count + 1
+
+        weights = {}
+        for position, ftp, print_time in zip(positions, ftps, print_times):
+            rank = PRIORITY_RANK.get(ftp.priority.name, -1) if ftp.priority else -1
+            weight = rank_unit ** (rank + 1) * time_unit + print_time
+            weights[position] = weight * queue_unit * (printers_count + 1) + (
+                queue_unit - position
+            )
+        return weights
+
+    def __solve(self, printers, deadline):
+        self.matcher.evaluate(printers)
+        candidates = [self.matcher.candidates(printer) for printer in printers]
+        rows = [i for i, positions in enumerate(candidates) if positions]
+        if not rows:
+            return []
+
+        weights = self.weights(
+            sorted({position for i in rows for position in candidates[i]}),
+            len(rows),
+        )
+        # A printer only ever needs as many of its best files as there are
+        # printers competing for them, the others are always left free
+        competing = {}
+        for i in rows:
+            for position in candidates[i]:
+                competing.setdefault(position, set()).add(i)
+        for i in rows:
+            rivals = set().union(*(competing[position] for position in candidates[i]))
+            candidates[i] = sorted(candidates[i], key=weights.get, reverse=True)[
+                : len(rivals)
+            ]
+
+        columns = sorted({position for i in rows for position in candidates[i]})
+        column_of = {position: j for j, position in enumerate(columns)}
+        # One "left idle" column per printer, at no cost; a forbidden pair
+        # costs more than leaving the printer idle
+        cost = []
+        for i in rows:
+            row = [1] * len(columns) + [0] * len(rows)
+            for position in candidates[i]:
+                row[column_of[position]] = -weights[position]
+            cost.append(row)
+
+        assigned = hungarian(cost, deadline)
+        return [
+            (printers[rows[row]], columns[column])
+            for row, column in sorted(assigned.items())
+            if column < len(columns)
+        ]
+
+    def match(self, printers):
+        printers = list(printers)
+        deadline = time.monotonic() + self.time_budget
+        try:
+            pairs = self.__solve(printers, deadline)
+        except TimeBudgetExceeded:
+            print(
+                f"Assignment of {len(printers)} printers took over"
+                f" {self.time_budget}s, matching greedily",
+                file=sys.stderr,
+            )
+            yield from self.matcher.match(printers)
+            return
+
+        for printer, position in pairs:
+            self.matcher.take(position)
+            yield (printer, self.printqueue[position])
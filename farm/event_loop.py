@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+
+class EventLoop:
+    """An asyncio loop running in a background thread, with one aiohttp session.
+
+    The farm polls the printers and the push listener follows them from this
+    loop, so the connections to OctoPrint are kept from one tick to the next.
+    Coroutines are sent to it from the farm's threads with run() or submit().
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._session = None
+        self._thread.start()
+
+    def __run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def session(self):
+        """The shared aiohttp session, only to be called from the loop."""
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    def submit(self, coro):
+        """Schedule `coro` on the loop, returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro):
+        """Run `coro` on the loop and wait for its result."""
+        return self.submit(coro).result()
+
+    def stop(self):
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
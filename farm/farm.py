@@ -1,26 +1,94 @@
+import asyncio
 import threading
 import datetime
 import os
-import uuid
 import sys
 import urllib
 
-from smb.SMBConnection import SMBConnection
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from .model.printer import Printer, PrinterRecord
+from pyrtable.context import set_default_context
+
+from .gcode_cache import GcodeCache
+from .metrics import metrics
+from .streaming import stream
+from .printqueue import PrintQueue, parse_limits
+from .model.context import AirtableContext
+from .model.mirror import Mirror
+from .model.snapshot import Snapshot
+from .model.writer import BatchWriter
+from .model.printer import (
+    Printer,
+    PrinterRecord,
+    PrinterProfileRecord,
+    PrinterGroupRecord,
+)
+from .model.filament import FilamentRecord, FilamentProfileRecord
 from .model.file_to_print import FileToPrintRecord
+from .model.print_model import PrintModelRecord
+from .model.printfile import PrintFileRecord
 from .model.print import PrintRecord, State
 
 
 class Farm:
     GCODES_DIR = os.getenv("LOCAL_GCODES_FOLDER_PATH")
+    GCODE_CACHE_MAX_BYTES = int(os.getenv("GCODE_CACHE_MAX_BYTES", 5 * 1024**3))
     SMB_REMOTE_PATH = os.getenv("REMOTE_GCODES_FOLDER_PATH")
-
-    def __init__(self):
+    SMB_POOL_SIZE = int(os.getenv("SMB_POOL_SIZE", 4))
+    SMB_HEALTH_CHECK_SECONDS = float(os.getenv("SMB_HEALTH_CHECK_SECONDS", 30))
+    # How many launches can be in each stage at the same time
+    LAUNCH_FETCH_CONCURRENCY = int(os.getenv("LAUNCH_FETCH_CONCURRENCY", SMB_POOL_SIZE))
+    LAUNCH_UPLOAD_CONCURRENCY = int(os.getenv("LAUNCH_UPLOAD_CONCURRENCY", 8))
+    LAUNCH_RECORD_CONCURRENCY = int(os.getenv("LAUNCH_RECORD_CONCURRENCY", 4))
+    AIRTABLE_JOURNAL_PATH = os.getenv("AIRTABLE_JOURNAL_PATH", "airtable_journal.jsonl")
+    # SQLite file the tables are mirrored to and read from, off when unset
+    AIRTABLE_MIRROR_PATH = os.getenv("AIRTABLE_MIRROR_PATH")
+    AIRTABLE_MIRROR_RECONCILE_SECONDS = float(
+        os.getenv("AIRTABLE_MIRROR_RECONCILE_SECONDS", 600)
+    )
+    OCTOPRINT_CONCURRENCY = int(os.getenv("OCTOPRINT_CONCURRENCY", 50))
+    OCTOPRINT_PUSH = os.getenv("OCTOPRINT_PUSH", "true").lower() == "true"
+    # Files queued per printer profile or group, PRINTQUEUE_LIMITS overrides
+    # it for some of them as "group or profile slug=limit,..."
+    PRINTQUEUE_LIMIT = int(os.getenv("PRINTQUEUE_LIMIT", 200))
+    PRINTQUEUE_LIMITS = parse_limits(os.getenv("PRINTQUEUE_LIMITS"))
+    # "cache" downloads to the local gcode cache first, "stream" pipes the NAS
+    # read straight into the upload
+    GCODE_TRANSFER_MODE = os.getenv("GCODE_TRANSFER_MODE", "cache")
+    PRESTAGE_GCODES = os.getenv("PRESTAGE_GCODES", "false").lower() == "true"
+    GCODE_STREAM_BUFFER_BYTES = int(os.getenv("GCODE_STREAM_BUFFER_BYTES", 4 * 1024**2))
+    # "greedy" gives each printer the first file it can print, "assignment"
+    # solves all ready printers at once, falling back to greedy past the budget
+    MATCHING_MODE = os.getenv("MATCHING_MODE", "greedy")
+    MATCHING_TIME_BUDGET = float(os.getenv("MATCHING_TIME_BUDGET", 2))
+    # One-shot runs only poll the printers when probe() finds nothing to do
+    FAST_START = os.getenv("FAST_START", "true").lower() == "true"
+
+    def __init__(self, poll_only=False):
+        """Load the farm, with `poll_only` only what polling the printers needs.
+
+        A poll-only farm has no print queue, no NAS connection and no
+        OctoPrint client but for the disconnected printers.
+        """
         self.launched_prints = []
+        self.transfers = []
+        self.staging = None
+        self.push = None
+        self._event_loop = None
+        self.launch_slots = {
+            "fetch": threading.BoundedSemaphore(Farm.LAUNCH_FETCH_CONCURRENCY),
+            "upload": threading.BoundedSemaphore(Farm.LAUNCH_UPLOAD_CONCURRENCY),
+            "record": threading.BoundedSemaphore(Farm.LAUNCH_RECORD_CONCURRENCY),
+        }
+        self._gcode_cache = None
+        self._gcode_cache_lock = threading.Lock()
+        self.__load_snapshot(with_queue=not poll_only)
+        if poll_only:
+            self.__create_printers(connect=False)
+            self.snapshot.flush()
+            return
 
         init_functions = [
             self.__create_printers,
@@ -34,53 +102,94 @@ class Farm:
             t.start()
         for t in threads:
             t.join()
+        self.snapshot.flush()
+
+    @property
+    def gcode_cache(self):
+        """Local cache of the NAS gcodes, created when the first one is opened."""
+        with self._gcode_cache_lock:
+            if self._gcode_cache is None:
+                self._gcode_cache = GcodeCache(
+                    os.path.join(Farm.GCODES_DIR, "cache"), Farm.GCODE_CACHE_MAX_BYTES
+                )
+            return self._gcode_cache
+
+    @staticmethod
+    @metrics.timed("probe")
+    def probe():
+        """Is there work for this run: a ready printer or gcodes to prestage.
+
+        Two Airtable requests at most, on the printer statuses of the last run.
+        """
+        if Farm.PRESTAGE_GCODES:
+            return True
+        set_default_context(AirtableContext())
+        for query in (PrinterRecord.get_ready(), PrinterRecord.get_ready_in_group()):
+            for _ in query:
+                return True
+        return False
+
+    @metrics.timed("load_snapshot")
+    def __load_snapshot(self, with_queue=True):
+        writer = BatchWriter(journal_path=Farm.AIRTABLE_JOURNAL_PATH)
+        writer.replay()
+        mirror = None
+        if Farm.AIRTABLE_MIRROR_PATH:
+            mirror = Mirror(
+                Farm.AIRTABLE_MIRROR_PATH,
+                reconcile_seconds=Farm.AIRTABLE_MIRROR_RECONCILE_SECONDS,
+            )
+        self.snapshot = Snapshot(writer=writer, mirror=mirror)
+        set_default_context(self.snapshot)
+        queries = [
+            PrinterRecord,
+            PrinterProfileRecord,
+            PrinterGroupRecord,
+            FilamentRecord,
+            FilamentProfileRecord,
+            PrintModelRecord,
+            PrintFileRecord,
+            PrintRecord.get_active(),
+        ]
+        if with_queue:
+            queries.append(FileToPrintRecord.get_next_files())
+        self.snapshot.load(queries)
 
-    def __create_printer(self, printer_record):
+    def __create_printer(self, printer_record, connect=True):
         printer_record.profile
         if printer_record.filament:
             printer_record.filament.profile
-        printer = Printer(printer_record)
+        printer = Printer(printer_record, connect=connect)
         self.printers.append(printer)
+        self.printers_by_id[printer_record.id] = printer
 
     def refresh_printer(self, printer):
         printer.refresh_status()
 
-    def __create_printqueue(self, printqueue_limit=200):
-        self.printqueue = []
-        files_to_print = list(FileToPrintRecord.get_next_files())
-
-        files_to_print = sorted(
-            sorted(files_to_print, key=lambda ftp: ftp.name),
-            key=lambda ftp: ftp.priority.name,
-            reverse=True,
-        )
-        self.printqueue.extend(files_to_print[:printqueue_limit])
-
-        # Order by priority and order name and printfile time
-        self.printqueue = sorted(
-            sorted(
-                sorted(
-                    self.printqueue,
-                    key=lambda ftp: ftp.print_model.print_time,
-                    reverse=True,
-                ),
-                key=lambda ftp: ftp.name,
-            ),
-            key=lambda ftp: ftp.priority.name,
-            reverse=True,
+    @metrics.timed("create_printqueue")
+    def __create_printqueue(self):
+        self.printqueue = PrintQueue(
+            FileToPrintRecord.get_next_files(),
+            limit=Farm.PRINTQUEUE_LIMIT,
+            limits=Farm.PRINTQUEUE_LIMITS,
         )
 
-    def __create_printers(self):
+    @metrics.timed("create_printers")
+    def __create_printers(self, connect=True):
         self.printers = []
+        self.printers_by_id = {}
         printers_records = PrinterRecord.get_all()
         threads = []
         for printer_record in printers_records:
-            t = threading.Thread(target=self.__create_printer, args=(printer_record,))
+            t = threading.Thread(
+                target=self.__create_printer, args=(printer_record, connect)
+            )
             threads.append(t)
             t.start()
         for t in threads:
             t.join()
 
+    @metrics.timed("refresh_printers")
     def refresh_printers(self):
         threads = []
         for printer in self.printers:
@@ -89,12 +198,136 @@ class Farm:
             t.start()
         for t in threads:
             t.join()
+        self.snapshot.flush()
+
+    @property
+    def event_loop(self):
+        """Loop the printers are polled and followed from, started on first use."""
+        if self._event_loop is None:
+            from .event_loop import EventLoop
+
+            self._event_loop = EventLoop()
+        return self._event_loop
+
+    async def __refresh_printer_async(self, printer, session, semaphore):
+        from .model.aio_octoprint import AsyncOctoprint
+
+        # Transitions may read and write Airtable (a finished print, the
+        # filament used), they run in the executor to keep the loop polling
+        loop = asyncio.get_running_loop()
+        record_id = printer.record.id
+        if (
+            self.push is not None
+            and self.push.is_live(record_id)
+            and not printer.is_disconnected()
+        ):
+            try:
+                await loop.run_in_executor(
+                    None, printer.update_status, self.push.state(record_id)
+                )
+            except Exception as e:
+                print(f"{printer} - {e}", file=sys.stderr)
+            return
 
-    def __find_printer_by_record(self, record):
+        async with semaphore:
+            try:
+                octoprint = AsyncOctoprint(
+                    url=printer.record.url,
+                    api_key=printer.record.octoprint_api_key,
+                    session=session,
+                    timeout=printer.octoprint_timeout,
+                    connect_timeout=printer.octoprint_connect_timeout,
+                )
+                raw_octo_status = await asyncio.wait_for(
+                    octoprint.state(), printer.octoprint_timeout
+                )
+                if printer.is_disconnected():
+                    # The printer is back, the blocking client has to be rebuilt
+                    await loop.run_in_executor(None, printer.refresh_status)
+                else:
+                    await loop.run_in_executor(
+                        None, printer.update_status, raw_octo_status
+                    )
+            except Exception as e:
+                print(f"{printer} - {e}", file=sys.stderr)
+
+    async def __refresh_printers_async(self, concurrency):
+        semaphore = asyncio.Semaphore(concurrency or Farm.OCTOPRINT_CONCURRENCY)
+        session = self.event_loop.session()
+        await asyncio.gather(
+            *(
+                self.__refresh_printer_async(printer, session, semaphore)
+                for printer in self.printers
+            )
+        )
+
+    def refresh_printers_async(self, concurrency=None):
+        """Poll every printer from the event loop, at most `concurrency` at a time.
+
+        The loop and its HTTP connections are kept between two calls. Printers
+        followed through the push API use their last pushed state.
+        """
+        with metrics.timer("refresh_printers_async"):
+            self.event_loop.run(self.__refresh_printers_async(concurrency))
+        self.snapshot.flush()
+
+    def start_push(self, changed=None):
+        """Follow the printers through OctoPrint's push API instead of polling them."""
+        from .push import PushListener
+
+        self.push = PushListener(self.event_loop, changed)
         for printer in self.printers:
-            if printer.record.id == record.id:
-                return printer
-        return None
+            self.push.watch(printer)
+
+    def close(self):
+        """Stop following the printers and close the connections to OctoPrint."""
+        if self.push is not None:
+            self.push.stop()
+            self.push = None
+        if self._event_loop is not None:
+            self._event_loop.stop()
+            self._event_loop = None
+
+    def __sync_printers(self):
+        printers_records = {record.id: record for record in PrinterRecord.get_all()}
+        if self.push is not None:
+            for printer in self.printers:
+                if printer.record.id not in printers_records:
+                    self.push.unwatch(printer.record.id)
+        self.printers = [
+            printer
+            for printer in self.printers
+            if printer.record.id in printers_records
+        ]
+        self.printers_by_id = {printer.record.id: printer for printer in self.printers}
+
+        threads = []
+        for record_id, printer_record in printers_records.items():
+            if record_id in self.printers_by_id:
+                continue
+            t = threading.Thread(target=self.__create_printer, args=(printer_record,))
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+        if self.push is not None:
+            for printer in self.printers:
+                self.push.watch(printer)
+        self.snapshot.flush()
+
+    @metrics.timed("refresh")
+    def refresh(self):
+        """Start a new scheduling cycle on an already running farm."""
+        self.launched_prints = []
+        self.transfers = []
+        self.snapshot.refresh()
+        PrintRecord.reset_active_index()
+        self.refresh_printers_async()
+        self.__sync_printers()
+        self.printqueue.sync(FileToPrintRecord.get_next_files())
+
+    def __find_printer_by_record(self, record):
+        return self.printers_by_id.get(record.id)
 
     def get_printer_by_name(self, name):
         for printer in self.printers:
@@ -102,7 +335,12 @@ class Farm:
                 return printer
         return None
 
+    @metrics.timed("connect_to_smb")
     def __connect_to_smb(self):
+        # pysmb, like aiohttp, NumPy and octorest, is imported on first use so
+        # that runs with nothing to launch do not pay for it
+        from .smb_pool import SMBPool
+
         share_name = os.getenv("SMB_SHARE")
         userID = os.getenv("SMB_USERID")
         password = os.getenv("SMB_PASSWD")
@@ -112,29 +350,38 @@ class Farm:
         server_name = ""
         domain_name = ""
 
-        conn = SMBConnection(
-            userID,
-            password,
-            client_machine_name,
-            server_name,
-            domain=domain_name,
-            use_ntlm_v2=True,
-            is_direct_tcp=True,
+        def connect():
+            from smb.SMBConnection import SMBConnection
+
+            conn = SMBConnection(
+                userID,
+                password,
+                client_machine_name,
+                server_name,
+                domain=domain_name,
+                use_ntlm_v2=True,
+                is_direct_tcp=True,
+            )
+            conn.connect(host, port)
+            return conn
+
+        self.smb = SMBPool(
+            connect,
+            size=Farm.SMB_POOL_SIZE,
+            health_check_after=Farm.SMB_HEALTH_CHECK_SECONDS,
         )
-        conn.connect(host, port)
-        shares = conn.listShares()
+        shares = self.smb.run(lambda conn: conn.listShares())
         share_con = None
 
         for share in shares:
             if share.name == share_name:
                 share_con = share
 
-        self.smb_con = conn
         self.share = share_con
 
     def file_exists_on_nas(self, remote_path):
-        shared_files = self.smb_con.listPath(
-            self.share.name, os.path.dirname(remote_path)
+        shared_files = self.smb.run(
+            lambda conn: conn.listPath(self.share.name, os.path.dirname(remote_path))
         )
         filename = os.path.basename(remote_path)
         for shared_file in shared_files:
@@ -142,33 +389,131 @@ class Farm:
                 return True
         return False
 
-    def download_gcode_from_nas(self, remote_path, local_path):
-        f = open(local_path, "wb")
-        self.smb_con.retrieveFile(self.share.name, remote_path, f)
-        f.close()xt_printer
+    def retrieve_from_nas(self, remote_path, f):
+        # A download can only be restarted on a new connection if it goes to a
+        # real file, the streaming pipe cannot be rewound
+        seekable = hasattr(f, "seekable") and f.seekable()
+        destination = self.smb.destination(f)
 
-    def launch_prints(self):
-        threads = []
-        matched_printers = self.match_printer_printqueue()
+        def retrieve(conn):
+            if seekable:
+                f.seek(0)
+                f.truncate()
+            _, size = conn.retrieveFile(self.share.name, remote_path, destination)
+            metrics.count("smb", nbytes=size, requests=0)
+
+        self.smb.run(retrieve, retries=None if seekable else 0, destination=destination)
 
-        for printer, ftp in matched_printers:
+    def get_nas_attributes(self, remote_path):
+        return self.smb.run(
+            lambda conn: conn.getAttributes(self.share.name, remote_path)
+        )
+
+    def download_gcode_from_nas(self, remote_path, local_path):
+        with open(local_path, "wb") as f:
+            self.retrieve_from_nas(remote_path, f)
+
+    def open_gcode(self, remote_path, attributes=None):
+        """Open the gcode through the local cache, only reading the NAS on a miss.
+
+        `attributes` are the NAS attributes of the gcode, when already known.
+        """
+        if attributes is None:
+            attributes = self.get_nas_attributes(remote_path)
+        return self.gcode_cache.open(
+            remote_path,
+            attributes.file_size,
+            attributes.last_write_time,
+            lambda f: self.retrieve_from_nas(remote_path, f),
+        )
+
+    def stream_gcode(self, remote_path, attributes=None):
+        """Pipe the gcode from the NAS while it is being uploaded.
+
+        Gcodes already in the local cache are served from disk.
+        """
+        if attributes is None:
+            attributes = self.get_nas_attributes(remote_path)
+        size, mtime = attributes.file_size, attributes.last_write_time
+        retrieve = lambda f: self.retrieve_from_nas(remote_path, f)
+        if self.gcode_cache.contains(remote_path, size, mtime):
+            return self.gcode_cache.open(remote_path, size, mtime, retrieve)
+        return stream(size, retrieve, max_buffer=Farm.GCODE_STREAM_BUFFER_BYTES)
+
+    def upload_gcode(self, printer, remote_path, filename, attributes=None):
+        if Farm.GCODE_TRANSFER_MODE == "stream":
             try:
-                self.launch_single_print(ftp, printer)
+                # The NAS read overlaps the upload, both run in the upload slot
+                with self.launch_slots["upload"], metrics.timer("launch.stream"):
+                    with self.stream_gcode(remote_path, attributes) as gcode:
+                        printer.prune_upload_directory()
+                        print_launched = printer.upload(
+                            (filename, gcode), to_print=True
+                        )
+                if hasattr(gcode, "throughput"):
+                    self.transfers.append((printer, filename, gcode))
+                return print_launched
+            except Exception as e:
+                print(
+                    f"{printer} - streaming {filename} failed, using the cache: {e}",
+                    file=sys.stderr,
+                )
+
+        with self.launch_slots["fetch"], metrics.timer("launch.fetch"):
+            gcode = self.open_gcode(remote_path, attributes)
+        with gcode, self.launch_slots["upload"], metrics.timer("launch.upload"):
+            printer.prune_upload_directory()
+            return printer.upload((filename, gcode), to_print=True)
+
+    @metrics.timed("launch")
+    def launch_matched(self, matched_printers):
+        """Launch the matched (printer, file to print) pairs concurrently.
+
+        Each pair runs in its own thread and a failure only affects its
+        printer. launch_slots bound the number of launches fetching,
+        uploading or writing to Airtable at once, and launched_prints keeps
+        the match order.
+        """
+        matched_printers = list(matched_printers)
+        launched = [None] * len(matched_printers)
+
+        def launch(i, printer, ftp):
+            try:
+                launched[i] = self.launch_single_print(ftp, printer)
             except Exception as e:
                 print(f"{printer}\n{ftp}", file=sys.stderr)
                 print(e, file=sys.stderr)
 
+        threads = []
+        for i, (printer, ftp) in enumerate(matched_printers):
+            t = threading.Thread(target=launch, args=(i, printer, ftp))
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.launched_prints.extend(item for item in launched if item is not None)
+        for print_, _ in self.launched_prints:
+            self.printqueue.remove(print_.file_to_print_id)
+        self.snapshot.flush()
+
+    def launch_prints(self):
+        with metrics.timer("match"):
+            matched = list(self.match_printer_printqueue())
+        self.launch_matched(matched)
+
+    def matcher(self):
+        if self.MATCHING_MODE == "assignment":
+            from .assignment import Assigner
+
+            return Assigner(self.printqueue, time_budget=self.MATCHING_TIME_BUDGET)
+        from .matcher import Matcher
+
+        return Matcher(self.printqueue)
+
     def match_printer_printqueue(self):
-        files_to_print = []
-        files_to_print.extend(self.printqueue)
         ready_printers = self.get_ready_printers()
-
-        for printer in ready_printers:
-            for ftp in files_to_print:
-                if printer.can_print(ftp):
-                    files_to_print.remove(ftp)
-                    yield (printer, ftp)
-                    break
+        yield from self.matcher().match(ready_printers)
 
     def get_ready_printers(self):
         printers_records = PrinterRecord.get_ready()
@@ -182,33 +527,13 @@ class Farm:
         return ready_printers
 
     def launch_prints_for_printers_in_group(self):
-        threads = []
-        matched_printers = self.match_printer_printqueue_group()
-
-        for printer, ftp in matched_printers:
-            try:
-                self.launch_single_print(ftp, printer)
-            except Exception as e:
-                print(f"{printer}\n{ftp}", file=sys.stderr)
-                print(e, file=sys.stderr)
-            # t = threading.Thread(target=self.launch_single_print, args=(ftp, printer,))
-            # threads.append(t)
-            # t.start()
-
-        # for t in threads:
-        # t.join()
+        with metrics.timer("match"):
+            matched = list(self.match_printer_printqueue_group())
+        self.launch_matched(matched)
 
     def match_printer_printqueue_group(self):
-        files_to_print = []
-        files_to_print.extend(self.printqueue)
         ready_printers = self.get_ready_printers_in_group()
-
-        for printer in ready_printers:
-            for file_to_print in files_to_print:
-                if printer.can_print(file_to_print):
-                    files_to_print.remove(file_to_print)
-                    yield (printer, file_to_print)
-                    break
+        yield from self.matcher().match(ready_printers)
 
     def get_ready_printers_in_group(self):
         printers_records = PrinterRecord.get_ready_in_group()
@@ -221,33 +546,93 @@ class Farm:
 
         return ready_printers
 
+    def gcode_remote_path(self, printfile):
+        return os.path.join(
+            self.SMB_REMOTE_PATH, printfile.printer_profile.slug, printfile.name
+        )
+
+    def predict_next_prints(self):
+        """Match the busy printers against what is left of the queue."""
+        busy_printers = [printer for printer in self.printers if printer.is_printing()]
+        return list(self.matcher().match(busy_printers))
+
+    def stage_next_prints(self):
+        """Upload the predicted next gcode of every busy printer in the background.
+
+        The launch then only has to select the staged file, or uploads as
+        usual if the plan changed in between.
+        """
+        if not Farm.PRESTAGE_GCODES:
+            return
+        if self.staging is not None and self.staging.is_alive():
+            return
+
+        predicted = self.predict_next_prints()
+
+        def stage_all():
+            threads = []
+            for printer, ftp in predicted:
+                t = threading.Thread(
+                    target=self.stage_single_print, args=(ftp, printer)
+                )
+                threads.append(t)
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.staging = threading.Thread(target=stage_all)
+        self.staging.start()
+
+    def stage_single_print(self, file_to_print, printer):
+        try:
+            printfile = file_to_print.print_model.get_gcode_for_printer_profile(
+                printer.record.profile
+            )
+            with printer.transfer_lock:
+                if printer.staged == printfile.name:
+                    return
+                with self.launch_slots["fetch"]:
+                    gcode = self.open_gcode(self.gcode_remote_path(printfile))
+                with gcode, self.launch_slots["upload"]:
+                    size = os.fstat(gcode.fileno()).st_size
+                    printer.stage((printfile.name, gcode), size)
+        except Exception as e:
+            print(f"{printer} - staging failed: {e}", file=sys.stderr)
+
+    @metrics.timed("launch_single_print")
     def launch_single_print(self, file_to_print, printer):
         printfile = file_to_print.print_model.get_gcode_for_printer_profile(
             printer.record.profile
         )
         filename = printfile.name
-
-        local_path = f"{Farm.GCODES_DIR}/{uuid.uuid4()}_{filename}"
-        remote_path = os.path.join(
-            self.SMB_REMOTE_PATH, printfile.printer_profile.slug, filename
-        )
-
-        self.download_gcode_from_nas(remote_path, local_path)
-
-        printer.clear_upload_directory()
-        print_launched = printer.upload(
-            (filename, open(local_path, "rb")), to_print=True
-        )
-        printer.refresh_status()
+        remote_path = self.gcode_remote_path(printfile)
+
+        with printer.transfer_lock:
+            # Staged or left by an earlier print, the gcode may already be there
+            with metrics.timer("launch.nas_attributes"):
+                attributes = self.get_nas_attributes(remote_path)
+            with metrics.timer("launch.list_upload_directory"):
+                printer.list_upload_directory()
+            if printer.has_remote_file(filename, attributes.file_size):
+                with metrics.timer("launch.print_uploaded"):
+                    print_launched = printer.print_uploaded(filename)
+            else:
+                printer.staged = None
+                print_launched = self.upload_gcode(
+                    printer, remote_path, filename, attributes
+                )
+        with metrics.timer("launch.refresh_status"):
+            printer.refresh_status()
 
         if print_launched:
-            print_ = PrintRecord(
-                state=State.IN_PROGRESS,
-                datetime_started=datetime.datetime.now(),
-                printer=printer.record,
-                file_to_print=file_to_print,
-            )
-            print_.save()
-            self.launched_prints.append((print_, printfile))
-
-        os.remove(local_path)
+            with self.launch_slots["record"], metrics.timer("launch.record"):
+                print_ = PrintRecord(
+                    state=State.IN_PROGRESS,
+                    datetime_started=datetime.datetime.now(),
+                    printer=printer.record,
+                    file_to_print=file_to_print,
+                )
+                print_.save()
+                print_.started()
+            return print_, printfile
+        return None
@@ -0,0 +1,164 @@
+import numpy as np
+
+from .model.print_model import PrintModelRecord
+
+NO_CODE = -1
+
+
+def _codes(values, codes):
+    """Small integer code of every value, None is NO_CODE."""
+    return np.array(
+        [
+            NO_CODE if value is None else codes.setdefault(value, len(codes))
+            for value in values
+        ],
+        dtype=np.int64,
+    )
+
+
+def _float(value):
+    return np.nan if value is None else value
+
+
+class Feasibility:
+    """Which printers can print which queued files, for one matching cycle.
+
+    The checks of Printer.can_print (gcode for the printer profile, printer
+    group or filament color, bed size and filament left) are computed for
+    every printer and file at once on NumPy arrays. Filament weights follow
+    PrintFileRecord.compute_weight_used operation for operation and every
+    distinct weight is rounded by Python's round(), so the matrix agrees
+    with can_print to the bit.
+    """
+
+    def __init__(self, printers, printqueue):
+        self.printers = list(printers)
+        self.printqueue = list(printqueue)
+        self.rows = {
+            printer.record.id: row for row, printer in enumerate(self.printers)
+        }
+        self.matrix = self.__compute()
+
+    def row(self, printer):
+        """Boolean array over the queue positions, True where the printer fits."""
+        return self.matrix[self.rows[printer.record.id]]
+
+    def __gcodes(self, profiles):
+        # Per printer profile and queued file: has a gcode, its sizes and its
+        # filament length (NaN where unknown). Looked up once per print model.
+        models = {}
+        file_model = np.array(
+            [
+                (
+                    models.setdefault(ftp.print_model_id, len(models))
+                    if ftp.print_model
+                    else NO_CODE
+                )
+                for ftp in self.printqueue
+            ]
+        )
+        print_models = {
+            ftp.print_model_id: ftp.print_model
+            for ftp in self.printqueue
+            if ftp.print_model
+        }
+        by_profile = PrintModelRecord.index_by_profile(print_models.values())
+
+        # The last model row stays empty, for the files without a model
+        has_gcode = np.zeros((len(profiles), len(models) + 1), dtype=bool)
+        gcodes = np.full((len(profiles), 4, len(models) + 1), np.nan)
+        for i, profile in enumerate(profiles):
+            for model_id in by_profile.get(profile.slug, ()):
+                m = models[model_id]
+                printfile = print_models[model_id].get_gcodes_by_profile()[profile.slug]
+                has_gcode[i, m] = True
+                gcodes[i, :, m] = [
+                    _float(printfile.size_x),
+                    _float(printfile.size_y),
+                    _float(printfile.size_z),
+                    _float(printfile.filament_used),
+                ]
+        return has_gcode[:, file_model], gcodes[:, :, file_model]
+
+    def __compute(self):
+        records = [printer.record for printer in self.printers]
+        if not records or not self.printqueue:
+            return np.zeros((len(records), len(self.printqueue)), dtype=bool)
+
+        profiles = {}
+        for record in records:
+            if record.profile:
+                profiles.setdefault(record.profile.id, record.profile)
+        has_gcode, gcodes = self.__gcodes(list(profiles.values()))
+        beds = np.array(
+            [
+                [_float(profile.size_x), _float(profile.size_y), _float(profile.size_z)]
+                for profile in profiles.values()
+            ]
+        )
+        fit_in_bed = np.all(gcodes[:, :3] <= beds[:, :, None], axis=1)
+        printable = has_gcode & fit_in_bed
+        filament_used = gcodes[:, 3]
+
+        groups, colors = {}, {}
+        file_group = _codes(
+            [
+                ftp.printer_group.name if ftp.printer_group else None
+                for ftp in self.printqueue
+            ],
+            groups,
+        )
+        file_color = _codes([ftp.color for ftp in self.printqueue], colors)
+        no_group = file_group == NO_CODE
+
+        # Printers sharing a profile, group and filament profile can print
+        # the same files but for the filament left
+        profile_rows = {profile_id: i for i, profile_id in enumerate(profiles)}
+        filament_profiles = {}
+        kinds = {}
+        printer_kind = []
+        remaining = []
+        for record in records:
+            filament = None
+            if not record.group and record.filament and record.filament.profile:
+                filament = record.filament
+            kind = (
+                profile_rows[record.profile.id] if record.profile else None,
+                record.group.name if record.group else None,
+                filament.profile.id if filament else None,
+            )
+            if filament:
+                filament_profiles.setdefault(filament.profile.id, filament.profile)
+            printer_kind.append(kinds.setdefault(kind, len(kinds)))
+            remaining.append(_float(filament.weight_remaining) if filament else np.nan)
+
+        static = np.zeros((len(kinds), len(self.printqueue)), dtype=bool)
+        weights = np.full((len(kinds), len(self.printqueue)), np.nan)
+        for (profile_row, group_name, filament_profile_id), k in kinds.items():
+            if profile_row is None:
+                continue
+            filament_profile = filament_profiles.get(filament_profile_id)
+            if group_name is not None:
+                static[k] = printable[profile_row] & (
+                    file_group == groups.setdefault(group_name, len(groups))
+                )
+            elif filament_profile is not None:
+                color = colors.setdefault(filament_profile.color, len(colors))
+                static[k] = printable[profile_row] & no_group & (file_color == color)
+                # Same operations, in the same order, as compute_weight_used
+                r = _float(filament_profile.diameter) / 2
+                h = filament_used[profile_row] * 1000
+                v = (np.pi * r**2 * h) / 1000
+                weights[k] = v * _float(filament_profile.density)
+
+        # NumPy rounds through a scaling by 100, Python's round() is exact
+        known = ~np.isnan(weights)
+        values, inverse = np.unique(weights[known], return_inverse=True)
+        rounded = np.array([round(value, 2) for value in values.tolist()])
+        weights[known] = rounded[inverse]
+
+        printer_kind = np.array(printer_kind)
+        remaining = np.array(remaining)
+        in_group = np.array([bool(record.group) for record in records])
+        enough_filament = remaining[:, None] >= weights[printer_kind]
+        return static[printer_kind] & (in_group[:, None] | enough_filament)
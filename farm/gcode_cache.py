@@ -0,0 +1,86 @@
+import hashlib
+import os
+import threading
+import uuid
+
+
+class GcodeCache:
+    """Size-bounded LRU cache of the NAS gcodes on local disk.
+
+    Entries are keyed by remote path, size and modification time, so a gcode
+    replaced on the NAS gets a new entry and the stale one ages out. Fills go
+    to a temporary file renamed into place, which keeps concurrent launches
+    (threads or processes) from ever reading a partial file.
+    """
+
+    SUFFIX = ".gcode"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(remote_path, size, mtime):
+        return hashlib.sha1(f"{remote_path}\0{size}\0{mtime}".encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + GcodeCache.SUFFIX)
+
+    def __key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def open(self, remote_path, size, mtime, fill):
+        """Open the cached gcode, calling fill(fileobj) to download it on a miss."""
+        key = self.key(remote_path, size, mtime)
+        path = self.path(key)
+
+        with self.__key_lock(key):
+            try:
+                f = open(path, "rb")
+                os.utime(path)
+                return f
+            except FileNotFoundError:
+                pass
+
+            tmp_path = f"{path}.{uuid.uuid4()}.tmp"
+            try:
+                with open(tmp_path, "wb") as tmp:
+                    fill(tmp)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            f = open(path, "rb")
+
+        self.evict(keep=path)
+        return f
+
+    def contains(self, remote_path, size, mtime):
+        return os.path.exists(self.path(self.key(remote_path, size, mtime)))
+
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(GcodeCache.SUFFIX):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+
+        # Files still open by a launch stay readable once unlinked
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,59 @@
+import numpy as np
+
+from .feasibility import Feasibility
+
+
+class Matcher:
+    """Greedy printer/file matching over a print queue.
+
+    Gives every ready printer, in order, the first queued file it can print,
+    like calling Printer.can_print on each file would. What each printer can
+    print is read from a Feasibility matrix computed once for all the
+    printers being matched, files already given to a printer are masked out.
+    """
+
+    def __init__(self, printqueue):
+        self.printqueue = list(printqueue)
+        self.taken = np.zeros(len(self.printqueue), dtype=bool)
+        self.rows = {}
+
+    def evaluate(self, printers):
+        """Compute in one pass what these printers can print, ahead of matching."""
+        printers = [
+            printer for printer in printers if printer.record.id not in self.rows
+        ]
+        if not printers:
+            return
+        feasibility = Feasibility(printers, self.printqueue)
+        for printer in printers:
+            self.rows[printer.record.id] = feasibility.row(printer)
+
+    def __free(self, printer):
+        if printer.record.id not in self.rows:
+            self.evaluate([printer])
+        return self.rows[printer.record.id] & ~self.taken
+
+    def take(self, position):
+        self.taken[position] = True
+
+    def candidates(self, printer):
+        """Queue positions of every file left the printer can print."""
+        return np.flatnonzero(self.__free(printer)).tolist()
+
+    def match_printer(self, printer):
+        free = self.__free(printer)
+        if not free.any():
+            return None
+
+        position = int(np.argmax(free))
+
+        self.take(position)
+        return self.printqueue[position]
+
+    def match(self, printers):
+        printers = list(printers)
+        self.evaluate(printers)
+        for printer in printers:
+            ftp = self.match_printer(printer)
+            if ftp is not None:
+                yield (printer, ftp)
@@ -0,0 +1,201 @@
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics are off unless one of these is set
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Set by launchprints.py --profile-startup, keeps the timings in memory only
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() == "true"
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _Timer:
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.phase, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """Phase timings and backend request counters of the farm.
+
+    Phases are timed with timer() or timed(), requests and bytes are counted
+    per backend ("airtable", "octoprint", "smb"...) and per printer. Every
+    flush() appends the cycle's figures as one line to the JSON-lines file,
+    and start() serves the running totals in the Prometheus text format.
+    When disabled, timers are a shared null context and counting returns
+    right away.
+    """
+
+    def __init__(
+        self, jsonl_path=METRICS_JSONL_PATH, port=METRICS_PORT, profile=STARTUP_PROFILE
+    ):
+        self.jsonl_path = jsonl_path
+        self.port = port
+        self.enabled = bool(jsonl_path or port or profile)
+        self.server = None
+        self._lock = threading.Lock()
+        # Since the start, for Prometheus
+        self._phases = {}
+        self._requests = {}
+        # Since the last flush, for the JSON lines
+        self._cycle_phases = {}
+        self._cycle_requests = {}
+
+    def timer(self, phase):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, phase)
+
+    def timed(self, phase):
+        """Decorator timing every call of the function as `phase`."""
+
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            def wrapper(*args, **kwargs):
+                with _Timer(self, phase):
+                    return func(*args, **kwargs)
+
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+
+        return decorator
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            for phases in (self._phases, self._cycle_phases):
+                count, total, longest = phases.get(phase, (0, 0.0, 0.0))
+                phases[phase] = (count + 1, total + seconds, max(longest, seconds))
+
+    def count(self, backend, printer=None, nbytes=0, requests=1):
+        if not self.enabled:
+            return
+        key = (backend, printer or "")
+        with self._lock:
+            for counters in (self._requests, self._cycle_requests):
+                done, sent = counters.get(key, (0, 0))
+                counters[key] = (done + requests, sent + nbytes)
+
+    def flush(self):
+        """Append the figures of the cycle since the last flush."""
+        if not self.enabled:
+            return
+        with self._lock:
+            phases, self._cycle_phases = self._cycle_phases, {}
+            requests, self._cycle_requests = self._cycle_requests, {}
+        if not self.jsonl_path:
+            return
+
+        backends = {}
+        for (backend, printer), (done, sent) in requests.items():
+            entry = backends.setdefault(
+                backend, {"requests": 0, "bytes": 0, "printers": {}}
+            )
+            entry["requests"] += done
+            entry["bytes"] += sent
+            if printer:
+                entry["printers"][printer] = {"requests": done, "bytes": sent}
+        line = {
+            "time": datetime.datetime.now().isoformat(),
+            "phases": {
+                phase: {"count": count, "seconds": total, "max": longest}
+                for phase, (count, total, longest) in phases.items()
+            },
+            "backends": backends,
+        }
+        try:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(line) + "\n")
+        except OSError as e:
+            print(f"Cannot write metrics to {self.jsonl_path}: {e}", file=sys.stderr)
+
+    def phases(self):
+        """(count, seconds, longest) of every phase since the start, in order."""
+        with self._lock:
+            return dict(self._phases)
+
+    def prometheus(self):
+        """Running totals in the Prometheus text exposition format."""
+        with self._lock:
+            phases = dict(self._phases)
+            requests = dict(self._requests)
+
+        lines = [
+            "# HELP farm_phase_seconds Time spent in each phase of the farm.",
+            "# TYPE farm_phase_seconds summary",
+        ]
+        for phase, (count, total, _) in sorted(phases.items()):
+            lines.append(f'farm_phase_seconds_sum{{phase="{phase}"}} {total}')
+            lines.append(f'farm_phase_seconds_count{{phase="{phase}"}} {count}')
+        lines += [
+            "# HELP farm_phase_seconds_max Longest run of each phase.",
+            "# TYPE farm_phase_seconds_max gauge",
+        ]
+        for phase, (_, _, longest) in sorted(phases.items()):
+            lines.append(f'farm_phase_seconds_max{{phase="{phase}"}} {longest}')
+
+        for name, index, help_text in (
+            ("farm_backend_requests_total", 0, "Requests sent to each backend."),
+            ("farm_backend_bytes_total", 1, "Bytes sent and received per backend."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (backend, printer), values in sorted(requests.items()):
+                labels = f'backend="{backend}",printer="{_escape(printer)}"'
+                lines.append(f"{name}{{{labels}}} {values[index]}")
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        """Serve /metrics on METRICS_PORT, in a daemon thread."""
+        if not self.port or self.server is not None:
+            return
+        handler = type("Handler", (_Handler,), {"metrics": self})
+        self.server = ThreadingHTTPServer(("", self.port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+metrics = Metrics()
@@ -1,13 +1,68 @@
 import os
+from pyrtable.filters.base import BaseFilter
+from pyrtable.query import RecordQuery
 from pyrtable.record import APIKeyFromSecretsFileMixin, BaseRecord
 
 BASE_ID = os.getenv("BASE_ID")
 
 
+class Formula(BaseFilter):
+    """Raw Airtable formula, for filters pyrtable cannot express."""
+
+    def __init__(self, formula):
+        self.formula = formula
+
+    def build_formula(self, record_class):
+        return self.formula
+
+    def __repr__(self):
+        return f"Formula({self.formula!r})"
+
+
+def modified_since(timestamp):
+    return Formula(
+        f'IS_AFTER(LAST_MODIFIED_TIME(), "{timestamp:%Y-%m-%dT%H:%M:%S.000Z}")'
+    )
+
+
+class Query(RecordQuery):
+    """RecordQuery with field projection and raw formula filters."""
+
+    fields = None
+
+    def only(self, *fields):
+        """Only fetch these fields, the records returned are partial."""
+        self.fields = fields
+        return self
+
+    def where(self, formula):
+        return self.filter(Formula(formula))
+
+
 class Base(APIKeyFromSecretsFileMixin, BaseRecord):
     class Meta:
         base_id = BASE_ID
+        record_query_class = Query
+        # Fields only fetched when a query asks for them with only()
+        deferred_fields = ()
+        # Fields the local mirror indexes, for the queries filtering on them
+        indexed_fields = ()
+
+    # Fields fetched if the record is partial, None for a full record
+    _projection = None
 
     @classmethod
     def get_all(cls):
         return cls.objects.all()
+
+    @classmethod
+    def get_column_names_for(cls, fields=None):
+        fields_by_name = dict(cls.iter_fields())
+        if fields is None:
+            deferred = cls._get_meta_attr("deferred_fields", ())
+            fields = [name for name in fields_by_name if name not in deferred]
+        return [
+            fields_by_name[name].column_name
+            for name in fields
+            if fields_by_name[name].column_name
+        ]
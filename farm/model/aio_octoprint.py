@@ -0,0 +1,133 @@
+import os
+from urllib import parse as urlparse
+
+import aiohttp
+
+from ..metrics import metrics
+
+
+class AsyncOctoprint:
+    """asyncio counterpart of Octoprint, sharing one aiohttp session between printers."""
+
+    def __init__(self, url, api_key, session, timeout=None, connect_timeout=None):
+        parsed = urlparse.urlparse(url or "")
+        if parsed.scheme not in ["http", "https"] or not parsed.netloc:
+            raise TypeError(f"Provided URL is not HTTP(S): {url}")
+
+        self.url = "{}://{}".format(parsed.scheme, parsed.netloc)
+        self.session = session
+        self.headers = {"X-Api-Key": api_key}
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout, sock_connect=connect_timeout
+        )
+
+    async def _check_response(self, response):
+        if not (200 <= response.status < 210):
+            error = await response.text()
+            msg = "Reply for {} was not OK: {} ({})"
+            msg = msg.format(response.url, error, response.status)
+            raise RuntimeError(msg)
+        return response
+
+    async def _get(self, path, params=None):
+        url = urlparse.urljoin(self.url, path)
+        async with self.session.get(
+            url, params=params, headers=self.headers, timeout=self.timeout
+        ) as response:
+            metrics.count("octoprint", self.url, response.content_length or 0)
+            await self._check_response(response)
+            return await response.json()
+
+    async def _post(self, path, data=None, json=None, ret=True):
+        url = urlparse.urljoin(self.url, path)
+        async with self.session.post(
+            url, data=data, json=json, headers=self.headers, timeout=self.timeout
+        ) as response:
+            metrics.count("octoprint", self.url, response.content_length or 0)
+            await self._check_response(response)
+            if ret:
+                return await response.json()
+
+    async def _delete(self, path):
+        url = urlparse.urljoin(self.url, path)
+        async with self.session.delete(
+            url, headers=self.headers, timeout=self.timeout
+        ) as response:
+            metrics.count("octoprint", self.url)
+            await self._check_response(response)
+
+    def _prepend_local(self, location):
+        if location.split("/")[0] not in ("local", "sdcard"):
+            return "local/" + location
+        return location
+
+    async def passive_login(self):
+        """Log in with the API key, returns the auth string of the push API."""
+        user = await self._post("/api/login", json={"passive": True})
+        return "{}:{}".format(user["name"], user["session"])
+
+    def push_url(self):
+        return urlparse.urljoin(self.url.replace("http", "ws", 1), "/sockjs/websocket")
+
+    async def state(self):
+        connection_info = await self._get("/api/connection")
+        return connection_info["current"]["state"]
+
+    async def files(self, location=None, recursive=False):
+        payload = {"recursive": str(recursive).lower()}
+        if location:
+            location = self._prepend_local(location)
+            return await self._get("/api/files/{}".format(location), params=payload)
+        return await self._get("/api/files", params=payload)
+
+    async def new_folder(self, folder_name, location="local"):
+        data = aiohttp.FormData({"foldername": folder_name})
+        return await self._post("/api/files/{}".format(location), data=data)
+
+    async def upload(
+        self,
+        file,
+        *,
+        location="local",
+        select=False,
+        print=False,
+        userdata=None,
+        path=None,
+    ):
+        """Upload a path or a (filename, file-like object) tuple."""
+        if isinstance(file, tuple):
+            filename, fileobj = file[0], file[1]
+        else:
+            filename, fileobj = os.path.basename(file), open(file, "rb")
+
+        data = aiohttp.FormData()
+        data.add_field(
+            "file",
+            fileobj,
+            filename=filename,
+            content_type="application/octet-stream",
+        )
+        data.add_field("select", str(select).lower())
+        data.add_field("print", str(print).lower())
+        if userdata:
+            data.add_field("userdata", userdata)
+        if path:
+            data.add_field("path", path)
+
+        try:
+            return await self._post("/api/files/{}".format(location), data=data)
+        finally:
+            if not isinstance(file, tuple):
+                fileobj.close()
+
+    async def select(self, location, *, print=False):
+        location = self._prepend_local(location)
+        data = {
+            "command": "select",
+            "print": print,
+        }
+        await self._post("/api/files/{}".format(location), json=data, ret=False)
+
+    async def delete(self, location):
+        location = self._prepend_local(location)
+        await self._delete("/api/files/{}".format(location))
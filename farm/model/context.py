@@ -0,0 +1,126 @@
+import json
+import urllib.parse
+
+from pyrtable.context import BaseContext
+
+from .transport import check_response, transport
+
+
+class AirtableContext(BaseContext):
+    """BaseContext sending every request through the shared transport.
+
+    Deferred fields (Meta.deferred_fields) are left out of every listing and
+    queries narrowed with only() fetch just their fields, the records they
+    return are marked partial through `_projection`.
+    """
+
+    def fetch_single(self, *, record_cls, record_id, base_and_table):
+        headers = record_cls.get_request_headers(base_id=base_and_table.base_id)
+        url = base_and_table.build_url(record_id=record_id)
+
+        response = transport.request(
+            "GET", url, base_id=base_and_table.base_id, headers=headers
+        )
+        if response.status_code == 404:
+            raise KeyError(record_id)
+        check_response(response)
+
+        record = record_cls(
+            _base_id=base_and_table.base_id, _table_id=base_and_table.table_id
+        )
+        record.consume_airtable_data(response.json())
+        return record
+
+    def list_records(self, *, record_cls, base_and_table, record_filter=None):
+        """Raw records of a listing as Airtable returns them, page after page."""
+        fields = getattr(base_and_table, "fields", None)
+        headers = record_cls.get_request_headers(base_id=base_and_table.base_id)
+        parsed_url = urllib.parse.urlparse(base_and_table.build_url())
+        params = urllib.parse.parse_qsl(parsed_url.query, keep_blank_values=True)
+
+        if record_filter:
+            formula = record_filter.build_formula(record_cls)
+            if formula:
+                params.append(("filterByFormula", formula))
+        params.extend(
+            ("fields[]", column_name)
+            for column_name in record_cls.get_column_names_for(fields)
+        )
+
+        while True:
+            url = parsed_url._replace(query=urllib.parse.urlencode(params)).geturl()
+            response = transport.request(
+                "GET", url, base_id=base_and_table.base_id, headers=headers
+            )
+            check_response(response)
+
+            response_json = response.json()
+            yield from response_json.get("records", [])
+
+            offset = response_json.get("offset")
+            if offset is None:
+                break
+            params = [param for param in params if param[0] != "offset"]
+            params.append(("offset", offset))
+
+    def fetch_many(self, *, record_cls, base_and_table, record_filter=None):
+        fields = getattr(base_and_table, "fields", None)
+        for record_data in self.list_records(
+            record_cls=record_cls,
+            base_and_table=base_and_table,
+            record_filter=record_filter,
+        ):
+            record = record_cls(
+                _base_id=base_and_table.base_id, _table_id=base_and_table.table_id
+            )
+            record.consume_airtable_data(record_data)
+            if fields is not None:
+                record._projection = fields
+            yield record
+
+    def _create(self, record_cls, record):
+        headers = record_cls.get_request_headers(
+            {"Content-Type": "application/json"}, base_id=record.base_id
+        )
+        data = {"fields": record.encode_to_airtable()}
+
+        response = transport.request(
+            "POST",
+            record.build_url(),
+            base_id=record.base_id,
+            headers=headers,
+            data=json.dumps(data),
+        )
+        check_response(response)
+
+        record.consume_airtable_data(response.json())
+
+    def _update(self, record_cls, record):
+        dirty_fields = record.encode_to_airtable()
+        if not dirty_fields:
+            return
+
+        headers = record_cls.get_request_headers(
+            {"Content-Type": "application/json"}, base_id=record.base_id
+        )
+        data = {"fields": dirty_fields}
+
+        response = transport.request(
+            "PATCH",
+            record.build_url(record_id=record.id),
+            base_id=record.base_id,
+            headers=headers,
+            data=json.dumps(data),
+        )
+        check_response(response)
+
+        record._clear_dirty_fields()
+
+    def delete_id(self, *, record_cls, record_id, base_and_table):
+        headers = record_cls.get_request_headers(base_id=base_and_table.base_id)
+        url = base_and_table.build_url(record_id=record_id)
+
+        response = transport.request(
+            "DELETE", url, base_id=base_and_table.base_id, headers=headers
+        )
+        check_response(response)
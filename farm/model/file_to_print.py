@@ -21,6 +21,7 @@ class Priority(enum.Enum):
 class FileToPrintRecord(Base):
     class Meta:
         table_id = "TPROD_FilesToPrint"
+        indexed_fields = ("prints", "priority")
 
     name = StringField("Name", read_only=True)
     label_name = StringField("Label name", read_only=True)
@@ -43,7 +44,9 @@ class FileToPrintRecord(Base):
 
     @classmethod
     def get_next_files(cls):
-        return cls.objects.filter(prints__empty=True, priority__empty=False)
+        return cls.objects.filter(prints__empty=True, priority__empty=False).only(
+            "name", "priority", "color", "print_model", "printer_group"
+        )
 
     @classmethod
     def get_high_priority(cls):
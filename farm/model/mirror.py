@@ -0,0 +1,290 @@
+import datetime
+import enum
+import json
+import sqlite3
+import threading
+
+from pyrtable.fields import BooleanField
+from pyrtable.filters import Q
+from pyrtable.filters.raw import (
+    AndFilter,
+    OrFilter,
+    NotFilter,
+    TrueFilter,
+    FalseFilter,
+    EqualsFilter,
+    NotEqualsFilter,
+    GreaterThanFilter,
+    LessThanFilter,
+    GreaterThanOrEqualsFilter,
+    LessThanOrEqualsFilter,
+    IsEmptyFilter,
+)
+
+from . import modified_since
+from .snapshot import REFRESH_OVERLAP
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    base_id TEXT NOT NULL,
+    table_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    created_time TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    PRIMARY KEY (base_id, table_id, id)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    base_id TEXT NOT NULL,
+    table_id TEXT NOT NULL,
+    synced_at TEXT NOT NULL,
+    reconciled_at TEXT NOT NULL,
+    PRIMARY KEY (base_id, table_id)
+);
+"""
+
+_COMPARISONS = {
+    GreaterThanFilter: ">",
+    LessThanFilter: "<",
+    GreaterThanOrEqualsFilter: ">=",
+    LessThanOrEqualsFilter: "<=",
+}
+
+
+def _column(column_name):
+    path = '$."' + column_name.replace('"', '\\"') + '"'
+    return "json_extract(fields, '" + path.replace("'", "''") + "')"
+
+
+def _value(value):
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if isinstance(value, (str, int, float)):
+        return value
+    raise ValueError(value)
+
+
+def _where(record_cls, record_filter):
+    """SQL condition and parameters equivalent to a pyrtable filter.
+
+    Airtable leaves empty fields out, an empty field is NULL here. Raises
+    ValueError for the filters that have no SQL equivalent.
+    """
+    if isinstance(record_filter, Q):
+        return _where(record_cls, record_filter._filter)
+    if isinstance(record_filter, (AndFilter, OrFilter)):
+        if not record_filter.filters:
+            return "1", []
+        parts = [_where(record_cls, flt) for flt in record_filter.filters]
+        operator = " AND " if isinstance(record_filter, AndFilter) else " OR "
+        return (
+            "(" + operator.join(sql for sql, _ in parts) + ")",
+            [param for _, params in parts for param in params],
+        )
+    if isinstance(record_filter, NotFilter):
+        sql, params = _where(record_cls, record_filter.filter)
+        return f"NOT COALESCE({sql}, 0)", params
+    if isinstance(record_filter, TrueFilter):
+        return "1", []
+    if isinstance(record_filter, FalseFilter):
+        return "0", []
+
+    if not hasattr(record_filter, "attr_name"):
+        raise ValueError(record_filter)
+    field = record_filter.get_field_object(record_cls, record_filter.attr_name)
+    column = _column(field.column_name)
+    value = record_filter.value
+    if isinstance(record_filter, IsEmptyFilter):
+        return f"{column} IS {'' if value else 'NOT '}NULL", []
+    if isinstance(record_filter, EqualsFilter):
+        if isinstance(field, BooleanField):
+            return (f"{column} = 1", []) if value else (f"{column} IS NULL", [])
+        if value is None:
+            return f"{column} IS NULL", []
+        return f"{column} = ?", [_value(value)]
+    if isinstance(record_filter, NotEqualsFilter):
+        return f"({column} IS NULL OR {column} != ?)", [_value(value)]
+    if type(record_filter) in _COMPARISONS:
+        return f"{column} {_COMPARISONS[type(record_filter)]} ?", [_value(value)]
+    raise ValueError(record_filter)
+
+
+class Mirror:
+    """Local SQLite copy of Airtable tables.
+
+    sync() only lists the records modified since the previous sync, and the
+    whole table every `reconcile_seconds` to drop the records deleted in
+    Airtable. Records are kept as Airtable returns them, the fields listed in
+    a record class' Meta.indexed_fields are indexed so that select() answers
+    the farm's queries without scanning the table. The mirror outlives the
+    process, a new run only pulls what changed since the last one.
+    """
+
+    def __init__(self, path, reconcile_seconds=600):
+        self.path = path
+        self.reconcile_after = datetime.timedelta(seconds=reconcile_seconds)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._indexed = set()
+        # Tables synced, or served stale after a failed sync, by this process
+        self.tables = set()
+
+    @staticmethod
+    def _key(record_cls):
+        return record_cls.get_class_base_id(), record_cls.get_class_table_id()
+
+    def __index(self, record_cls):
+        if record_cls in self._indexed:
+            return
+        table_id = record_cls.get_class_table_id()
+        fields = dict(record_cls.iter_fields())
+        for attr_name in record_cls._get_meta_attr("indexed_fields", ()):
+            column_name = fields[attr_name].column_name
+            name = f"{table_id}_{column_name}".replace('"', "")
+            self._db.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}"'
+                f" ON records (base_id, table_id, {_column(column_name)})"
+            )
+        self._db.commit()
+        self._indexed.add(record_cls)
+
+    def __state(self, key):
+        row = self._db.execute(
+            "SELECT synced_at, reconciled_at FROM syncs"
+            " WHERE base_id = ? AND table_id = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None, None
+        return tuple(datetime.datetime.fromisoformat(value) for value in row)
+
+    def sync(self, record_cls, list_records):
+        """Pull the changes of the table, returns (changed records, deleted ids).
+
+        `list_records(record_filter)` lists the table from Airtable, as raw
+        records.
+        """
+        key = self._key(record_cls)
+        started = datetime.datetime.utcnow()
+        with self._lock:
+            self.__index(record_cls)
+            synced_at, reconciled_at = self.__state(key)
+        reconcile = reconciled_at is None or started - reconciled_at > (
+            self.reconcile_after
+        )
+        if reconcile:
+            records = list(list_records(None))
+        else:
+            records = list(list_records(modified_since(synced_at - REFRESH_OVERLAP)))
+
+        deleted = set()
+        with self._lock, self._db:
+            if reconcile:
+                listed = {record["id"] for record in records}
+                deleted = {
+                    record_id
+                    for (record_id,) in self._db.execute(
+                        "SELECT id FROM records WHERE base_id = ? AND table_id = ?",
+                        key,
+                    )
+                    if record_id not in listed
+                }
+                self._db.executemany(
+                    "DELETE FROM records WHERE base_id = ? AND table_id = ? AND id = ?",
+                    [(*key, record_id) for record_id in deleted],
+                )
+                reconciled_at = started
+            self._db.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        *key,
+                        record["id"],
+                        record["createdTime"],
+                        json.dumps(record.get("fields", {})),
+                    )
+                    for record in records
+                ],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)",
+                (*key, started.isoformat(), reconciled_at.isoformat()),
+            )
+        self.tables.add(record_cls)
+        return records, deleted
+
+    def has(self, record_cls):
+        """Was the table ever synced."""
+        with self._lock:
+            return self.__state(self._key(record_cls))[0] is not None
+
+    @staticmethod
+    def _record(row):
+        record_id, created_time, fields = row
+        return {
+            "id": record_id,
+            "createdTime": created_time,
+            "fields": json.loads(fields),
+        }
+
+    def get(self, record_cls, record_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, created_time, fields FROM records"
+                " WHERE base_id = ? AND table_id = ? AND id = ?",
+                (*self._key(record_cls), record_id),
+            ).fetchone()
+        return None if row is None else self._record(row)
+
+    def select(self, record_cls, record_filter):
+        """Records matching the filter, raises ValueError if SQL cannot express it."""
+        sql, params = _where(record_cls, record_filter) if record_filter else ("1", [])
+        with self._lock:
+            self.__index(record_cls)
+            rows = self._db.execute(
+                "SELECT id, created_time, fields FROM records"
+                f" WHERE base_id = ? AND table_id = ? AND {sql}"
+                # Airtable lists records in creation order
+                " ORDER BY created_time, id",
+                (*self._key(record_cls), *params),
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def store(self, record_cls, record):
+        """Write a record saved by the farm, ahead of the next sync."""
+        # Read-only fields are never encoded, they keep their synced value
+        encoded = record.encode_to_airtable(include_non_dirty_fields=True)
+        key = (*self._key(record_cls), record.id)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT created_time, fields FROM records"
+                " WHERE base_id = ? AND table_id = ? AND id = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                created_time = f"{record.created_timestamp:%Y-%m-%dT%H:%M:%S.000Z}"
+                fields = {}
+            else:
+                created_time, fields = row[0], json.loads(row[1])
+            for column_name, value in encoded.items():
+                # Airtable leaves empty fields out, 0 is a value
+                if value is None or value is False or value == "" or value == []:
+                    fields.pop(column_name, None)
+                else:
+                    fields[column_name] = value
+            self._db.execute(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                (*key, created_time, json.dumps(fields)),
+            )
+
+    def delete(self, record_cls, record_id):
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM records WHERE base_id = ? AND table_id = ? AND id = ?",
+                (*self._key(record_cls), record_id),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
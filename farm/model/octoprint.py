@@ -6,15 +6,20 @@ from time import sleep
 
 from requests_toolbelt.multipart import encoder
 
+from ..metrics import metrics
+
 
 class Octoprint(OctoRest):
     def __init__(self, url, api_key, timeout=None, session=None):
+        # timeout can be a (connect, read) tuple, uploads only get the connect part
         self.timeout = timeout
+        self.upload_timeout = (timeout[0], None) if isinstance(timeout, tuple) else None
         super().__init__(url=url, apikey=api_key, session=session)
 
     def _get(self, path, params=None):
         url = urlparse.urljoin(self.url, path)
         response = self.session.get(url, params=params, timeout=self.timeout)
+        metrics.count("octoprint", self.url, len(response.content))
         self._check_response(response)
 
         return response.json()
@@ -22,7 +27,10 @@ class Octoprint(OctoRest):
     def _post(self, path, data=None, files=None, json=None, ret=True):
         url = urlparse.urljoin(self.url, path)
         if not files:
-            response = self.session.post(url, data=data, files=files, json=json)
+            response = self.session.post(
+                url, data=data, files=files, json=json, timeout=self.timeout
+            )
+            metrics.count("octoprint", self.url, len(response.content))
         else:
             data.update(
                 {
@@ -36,13 +44,24 @@ class Octoprint(OctoRest):
             headers.update({"Content-Type": file_data.content_type})
 
             response = self.session.post(
-                url, headers=headers, data=file_data, json=json
+                url,
+                headers=headers,
+                data=file_data,
+                json=json,
+                timeout=self.upload_timeout,
             )
+            metrics.count("octoprint", self.url, file_data.len + len(response.content))
 
         self._check_response(response)
         if ret:
             return response.json()
 
+    def _delete(self, path):
+        url = urlparse.urljoin(self.url, path)
+        response = self.session.delete(url, timeout=self.timeout)
+        metrics.count("octoprint", self.url, len(response.content))
+        self._check_response(response)
+
     def new_folder(self, folder_name, location="local"):
         """Upload file or create folder
         http://docs.octoprint.org/en/master/api/files.html#upload-file-or-create-folder
@@ -1,5 +1,6 @@
 import datetime
 import enum
+import threading
 from pyrtable.fields import (
     StringField,
     SingleSelectionField,
@@ -22,6 +23,7 @@ class State(enum.Enum):
 class PrintRecord(Base):
     class Meta:
         table_id = "TPROD_Prints"
+        indexed_fields = ("state",)
 
     name = StringField("Name", read_only=True)
     state = SingleSelectionField("State", choices=State)
@@ -34,9 +36,37 @@ class PrintRecord(Base):
         "FileToPrint", linked_class="farm.model.file_to_print.FileToPrintRecord"
     )
 
+    # Printer id -> active PrintRecord, built from one get_active() listing
+    # per cycle and kept up to date as prints start and finish
+    _active_by_printer = None
+    _active_lock = threading.Lock()
+
     @classmethod
     def get_active(cls):
-        return cls.objects.filter(state=State.IN_PROGRESS)
+        return cls.objects.filter(state=State.IN_PROGRESS).only(
+            "name", "state", "printer", "file_to_print"
+        )
+
+    @classmethod
+    def get_active_by_printer(cls):
+        with cls._active_lock:
+            if cls._active_by_printer is None:
+                index = {}
+                for active in cls.get_active():
+                    if active.printer_id:
+                        index.setdefault(active.printer_id, active)
+                cls._active_by_printer = index
+            return cls._active_by_printer
+
+    @classmethod
+    def reset_active_index(cls):
+        with cls._active_lock:
+            cls._active_by_printer = None
+
+    def started(self):
+        with self._active_lock:
+            if self._active_by_printer is not None and self.printer_id:
+                self._active_by_printer[self.printer_id] = self
 
     def __repr__(self):
         return f"<PrintRecord: name={self.name}, state={self.state}>"
@@ -45,3 +75,7 @@ class PrintRecord(Base):
         self.state = State.FINISHED
         self.datetime_finished = datetime.datetime.now()
         self.save()
+        with self._active_lock:
+            index = self._active_by_printer
+            if index is not None and index.get(self.printer_id) is self:
+                del index[self.printer_id]
@@ -13,11 +13,30 @@ class PrintModelRecord(Base):
         "Gcodes", linked_class="farm.model.printfile.PrintFileRecord"
     )
 
+    # (printfiles ids, {printer profile slug: printfile})
+    _gcodes = None
+
     def __repr__(self):
         return f"<PrintModelRecord: name=({self.name})>"
 
+    def get_gcodes_by_profile(self):
+        printfiles_ids = tuple(self.printfiles_ids)
+        if self._gcodes is None or self._gcodes[0] != printfiles_ids:
+            gcodes = {}
+            for printfile in self.printfiles:
+                if printfile.printer_profile:
+                    gcodes.setdefault(printfile.printer_profile.slug, printfile)
+            self._gcodes = (printfiles_ids, gcodes)
+        return self._gcodes[1]
+
     def get_gcode_for_printer_profile(self, printer_profile, default=None):
-        for printfile in self.printfiles:
-            if printfile.printer_profile.slug == printer_profile.slug:
-                return printfile
-        return default
+        return self.get_gcodes_by_profile().get(printer_profile.slug, default)
+
+    @classmethod
+    def index_by_profile(cls, print_models):
+        """Map each printer profile slug to the ids of the models having a gcode for it."""
+        index = {}
+        for print_model in print_models:
+            for slug in print_model.get_gcodes_by_profile():
+                index.setdefault(slug, set()).add(print_model.id)
+        return index
@@ -1,5 +1,7 @@
+import os
 import sys
 import enum
+import threading
 from pyrtable.fields import (
     IntegerField,
     StringField,
@@ -10,10 +12,14 @@ from pyrtable.fields import (
 )
 
 from . import Base
-from .octoprint import Octoprint
 from .print import PrintRecord
+from .sessions import session_pool
 
 OCTOPRINT_TIMEOUT = 10
+OCTOPRINT_CONNECT_TIMEOUT = 3.05
+# Gcodes kept in the upload folder besides the one being printed, so a model
+# printed again does not need a new upload
+UPLOAD_RETENTION = int(os.getenv("OCTOPRINT_UPLOAD_RETENTION", 3))
 
 
 class Status(enum.Enum):
@@ -74,6 +80,7 @@ class PrinterGroupRecord(Base):
 class PrinterRecord(Base):
     class Meta:
         table_id = "TPROD_Printers"
+        indexed_fields = ("status", "clean_plate", "group")
 
     name = StringField("Name", read_only=True)
     status = SingleSelectionField("Status", choices=Status)
@@ -105,7 +112,7 @@ class PrinterRecord(Base):
             filament__empty=False,
             profile__empty=False,
             group__empty=True,
-        )
+        ).only("name")
         return ready_printers
 
     @classmethod
@@ -116,7 +123,7 @@ class PrinterRecord(Base):
             clean_plate=True,
             profile__empty=False,
             group__empty=False,
-        )
+        ).only("name")
         return ready_printers
 
     @classmethod
@@ -127,30 +134,34 @@ class PrinterRecord(Base):
         return None
 
     def get_last_print(self):
-        n_prints = len(self.prints)
-        if n_prints > 0:
-            return list(self.prints)[n_prints - 1]
+        prints_ids = list(self.prints_ids)
+        if prints_ids:
+            return PrintRecord.objects.get(prints_ids[-1])
         else:
             return None
 
     def get_active_print(self):
-        active_prints = PrintRecord.get_active()
-        for active in active_prints:
-            if self.id == active.printer.id:
-                return active
-        return None
+        return PrintRecord.get_active_by_printer().get(self.id)
 
 
 class Printer:
     UPLOAD_DIR = "3DFP"
 
-    def __init__(self, record):
+    def __init__(self, record, connect=True):
         self.record = record
         self.octoprint_timeout = OCTOPRINT_TIMEOUT
+        self.octoprint_connect_timeout = OCTOPRINT_CONNECT_TIMEOUT
         self.octoprint = None
-
-        self.create_octoprint_connection()
-        self.init_upload_directory()
+        # Name of the gcode uploaded ahead for the next print
+        self.staged = None
+        # Held while a gcode is being staged or launched
+        self.transfer_lock = threading.Lock()
+        # Gcodes in the upload folder by name, as listed by OctoPrint
+        self.remote_files = {}
+
+        if connect:
+            self.create_octoprint_connection()
+            self.init_upload_directory()
 
     def __repr__(self):
         return f"<{self.record.name}: {self.record.status} ({self.record.group})>"
@@ -169,25 +180,66 @@ class Printer:
         if self.is_connected() and not self.__upload_dir_exists():
             self.__create_upload_dir()
 
-    def clear_upload_directory(self):
+    def list_upload_directory(self):
         try:
             files = self.octoprint.files(location=Printer.UPLOAD_DIR, recursive=True)
         except Exception as e:
             raise (Exception(f"{self} - {e}"))
 
-        for f in files["children"]:
-            try:
-                self.octoprint.delete(f["path"])
-            except Exception as e:
-                print(f"Error while clearing upload directory of {self}")
-                print(e)
+        self.remote_files = {
+            f["name"]: f for f in files["children"] if f.get("type") != "folder"
+        }
+        return self.remote_files
+
+    def has_remote_file(self, filename, size):
+        """Is this gcode already uploaded, going by the last listing."""
+        remote_file = self.remote_files.get(filename)
+        return remote_file is not None and remote_file.get("size") == size
+
+    def __delete_remote_file(self, remote_file):
+        try:
+            self.octoprint.delete(remote_file["path"])
+            self.remote_files.pop(remote_file["name"], None)
+        except Exception as e:
+            print(f"Error while clearing upload directory of {self}")
+            print(e)
+
+    def prune_upload_directory(self, keep=(), retention=UPLOAD_RETENTION):
+        """Delete the listed gcodes, in parallel.
+
+        `keep`, the staged gcode and the `retention` most recent ones are left.
+        """
+        keep = set(keep)
+        if self.staged:
+            keep.add(self.staged)
+        remote_files = sorted(
+            (f for name, f in self.remote_files.items() if name not in keep),
+            key=lambda f: f.get("date") or 0,
+            reverse=True,
+        )
+
+        threads = []
+        for remote_file in remote_files[retention:]:
+            t = threading.Thread(target=self.__delete_remote_file, args=(remote_file,))
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+
+    def clear_upload_directory(self, keep=()):
+        self.list_upload_directory()
+        self.prune_upload_directory(keep=keep, retention=0)
 
     def create_octoprint_connection(self):
+        # octorest and requests_toolbelt are only needed with a printer to drive
+        from .octoprint import Octoprint
+
         try:
             self.octoprint = Octoprint(
                 url=self.record.url,
                 api_key=self.record.octoprint_api_key,
-                timeout=self.octoprint_timeout,
+                timeout=(self.octoprint_connect_timeout, self.octoprint_timeout),
+                session=session_pool.get(self.record.url),
             )
         except Exception as e:
             self.octoprint = None
@@ -203,53 +255,55 @@ class Printer:
         if self.is_disconnected():
             self.create_octoprint_connection()
         else:
-            raw_octo_status = self.octoprint.state()
-            if not (raw_octo_status in status_from_octoprint.keys()):
-                if "Failed to autodetect serial port" in raw_octo_status:
-                    octo_status = Status.SERIAL_PORT_ERROR
-                else:
-                    raise Exception(
-                        f'Octoprint status not found: "{raw_octo_status}", {self.__repr__()}'
-                    )
-            else:
-                octo_status = status_from_octoprint[raw_octo_status]
-
-            if self.is_printing() and octo_status == Status.OPERATIONAL:
-                self.set_status(Status.HARVEST)
-                active_print = self.record.get_active_print()
-                if active_print:
-                    active_print.finished()
-                    if self.record.filament:
-                        printfile = active_print.file_to_print.print_model.get_gcode_for_printer_profile(
-                            self.record.profile
-                        )
-                        self.record.filament.used(
-                            printfile.get_weight_used(self.record.filament.profile)
-                        )
-            elif (
-                self.is_harvest() or self.is_operational()
-            ) and octo_status == Status.PRINTING:
-                self.record.clean_plate = False
-                self.set_status(Status.PRINTING)
-            elif self.is_maintenance() or self.is_restart():
-                pass  # Do not update status
-            elif self.is_harvest() and octo_status != Status.PRINTING:
-                pass  # Do not update status
-            elif (
-                (self.is_disconnected() or self.is_operational())
-                and octo_status == Status.OPERATIONAL
-                and not self.record.clean_plate
-            ):
-                self.set_status(Status.HARVEST)
-            elif (
-                self.is_printing()
-                and octo_status == Status.PRINTING
-                and self.record.clean_plate
-            ):
-                self.record.clean_plate = False
-                self.record.save()
+            self.update_status(self.octoprint.state())
+
+    def update_status(self, raw_octo_status):
+        if not (raw_octo_status in status_from_octoprint.keys()):
+            if "Failed to autodetect serial port" in raw_octo_status:
+                octo_status = Status.SERIAL_PORT_ERROR
             else:
-                self.set_status(octo_status)
+                raise Exception(
+                    f'Octoprint status not found: "{raw_octo_status}", {self.__repr__()}'
+                )
+        else:
+            octo_status = status_from_octoprint[raw_octo_status]
+
+        if self.is_printing() and octo_status == Status.OPERATIONAL:
+            self.set_status(Status.HARVEST)
+            active_print = self.record.get_active_print()
+            if active_print:
+                active_print.finished()
+                if self.record.filament:
+                    printfile = active_print.file_to_print.print_model.get_gcode_for_printer_profile(
+                        self.record.profile
+                    )
+                    self.record.filament.used(
+                        printfile.get_weight_used(self.record.filament.profile)
+                    )
+        elif (
+            self.is_harvest() or self.is_operational()
+        ) and octo_status == Status.PRINTING:
+            self.record.clean_plate = False
+            self.set_status(Status.PRINTING)
+        elif self.is_maintenance() or self.is_restart():
+            pass  # Do not update status
+        elif self.is_harvest() and octo_status != Status.PRINTING:
+            pass  # Do not update status
+        elif (
+            (self.is_disconnected() or self.is_operational())
+            and octo_status == Status.OPERATIONAL
+            and not self.record.clean_plate
+        ):
+            self.set_status(Status.HARVEST)
+        elif (
+            self.is_printing()
+            and octo_status == Status.PRINTING
+            and self.record.clean_plate
+        ):
+            self.record.clean_plate = False
+            self.record.save()
+        else:
+            self.set_status(octo_status)
 
     def is_disconnected(self):
         return (
@@ -337,6 +391,31 @@ class Printer:
         )
         return True
 
+    def stage(self, file, size):
+        """Upload the gcode of the next print next to the one being printed."""
+        filename = file[0]
+        self.list_upload_directory()
+        if not self.has_remote_file(filename, size):
+            self.unstage()
+            self.upload(file)
+        self.staged = filename
+
+    def unstage(self):
+        if self.staged is None:
+            return
+        try:
+            self.octoprint.delete(f"{Printer.UPLOAD_DIR}/{self.staged}")
+        except Exception as e:
+            print(f"{self} - {e}", file=sys.stderr)
+        self.staged = None
+
+    def print_uploaded(self, filename):
+        """Print a gcode already in the upload folder, then prune the others."""
+        self.staged = None
+        printed = self.print(filename)
+        self.prune_upload_directory(keep=(filename,))
+        return printed
+
     def print(self, remote_filename):
         try:
             self.octoprint.select(
@@ -13,6 +13,8 @@ from . import Base
 class PrintFileRecord(Base):
     class Meta:
         table_id = "TPROD_PrintFiles"
+        # The gcode attachment is heavy and the farm reads gcodes from the NAS
+        deferred_fields = ("gcode",)
 
     name = StringField("Name", read_only=True)
     gcode = AttachmentField("File", read_only=True)
@@ -30,8 +32,12 @@ class PrintFileRecord(Base):
         return f"<PrintFileRecord: name=({self.name}), profile={self.printer_profile}>"
 
     def get_weight_used(self, filament_profile):
+        return self.compute_weight_used(self.filament_used, filament_profile)
+
+    @staticmethod
+    def compute_weight_used(filament_used, filament_profile):
         r = filament_profile.diameter / 2
-        h = self.filament_used * 1000
+        h = filament_used * 1000
         v = (math.pi * r**2 * h) / 1000
         p = round(v * filament_profile.density, 2)
 
@@ -0,0 +1,76 @@
+import os
+import threading
+from urllib import parse as urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = int(os.getenv("OCTOPRINT_POOL_SIZE", 4))
+RETRIES = int(os.getenv("OCTOPRINT_RETRIES", 3))
+BACKOFF_FACTOR = float(os.getenv("OCTOPRINT_BACKOFF_FACTOR", 0.3))
+
+
+class SessionPool:
+    """Keep-alive requests sessions, one per OctoPrint host.
+
+    Sessions outlive the Printer objects using them, so reconnections and
+    daemon cycles reuse the open TCP connections. Failed connections and
+    idempotent requests (GET, DELETE...) are retried with exponential
+    backoff at the transport level; POSTs are never replayed since they
+    could start a print twice.
+    """
+
+    def __init__(
+        self, pool_size=POOL_SIZE, retries=RETRIES, backoff_factor=BACKOFF_FACTOR
+    ):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url):
+        parsed = urlparse.urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _create_session(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url):
+        host = self._host(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._create_session()
+                self._sessions[host] = session
+            return session
+
+    def discard(self, url):
+        with self._lock:
+            session = self._sessions.pop(self._host(url), None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+session_pool = SessionPool()
@@ -0,0 +1,483 @@
+import datetime
+import enum
+import functools
+import sys
+import threading
+
+from pyrtable.fields import BooleanField
+from pyrtable.filters import Q
+from pyrtable.filters.raw import (
+    AndFilter,
+    OrFilter,
+    NotFilter,
+    TrueFilter,
+    FalseFilter,
+    EqualsFilter,
+    NotEqualsFilter,
+    IsEmptyFilter,
+)
+from pyrtable.query import RecordQuery
+
+from . import modified_since
+from .context import AirtableContext
+
+# Overlap between incremental refreshes, covers clock skew with Airtable
+REFRESH_OVERLAP = datetime.timedelta(seconds=60)
+# Every RECONCILE_EVERY refreshes whole tables are listed again to drop
+# records deleted in Airtable
+RECONCILE_EVERY = 30
+
+
+def _filter_attrs(record_filter):
+    """Fields a filter reads, raises ValueError if _matches cannot evaluate it."""
+    if isinstance(record_filter, Q):
+        return _filter_attrs(record_filter._filter)
+    if isinstance(record_filter, (AndFilter, OrFilter)):
+        return {attr for flt in record_filter.filters for attr in _filter_attrs(flt)}
+    if isinstance(record_filter, NotFilter):
+        return _filter_attrs(record_filter.filter)
+    if isinstance(record_filter, (TrueFilter, FalseFilter)):
+        return set()
+    if isinstance(record_filter, (EqualsFilter, NotEqualsFilter, IsEmptyFilter)):
+        return {record_filter.attr_name}
+    raise ValueError(record_filter)
+
+
+def _matches(record_cls, record_filter, fields):
+    """Does a record, as the `fields` Airtable returns, match the filter.
+
+    Airtable leaves empty fields out. Only the filters _filter_attrs accepts.
+    """
+    if isinstance(record_filter, Q):
+        return _matches(record_cls, record_filter._filter, fields)
+    if isinstance(record_filter, AndFilter):
+        return all(_matches(record_cls, flt, fields) for flt in record_filter.filters)
+    if isinstance(record_filter, OrFilter):
+        return any(_matches(record_cls, flt, fields) for flt in record_filter.filters)
+    if isinstance(record_filter, NotFilter):
+        return not _matches(record_cls, record_filter.filter, fields)
+    if isinstance(record_filter, (TrueFilter, FalseFilter)):
+        return isinstance(record_filter, TrueFilter)
+
+    field = record_filter.get_field_object(record_cls, record_filter.attr_name)
+    value = fields.get(field.column_name)
+    expected = record_filter.value
+    if isinstance(expected, enum.Enum):
+        expected = expected.value
+    if isinstance(record_filter, IsEmptyFilter):
+        return (value in (None, "", [])) == expected
+    if isinstance(field, BooleanField):
+        equal = bool(value) == bool(expected)
+    else:
+        equal = value == expected
+    return equal if isinstance(record_filter, EqualsFilter) else not equal
+
+
+class Snapshot(AirtableContext):
+    """Per-cycle identity map of the Airtable tables.
+
+    load() lists each table (or filtered query) once, every record is then
+    kept by id and link fields resolve from memory instead of fetching the
+    linked records one by one. Partial records from projected queries are
+    never put in the map, their ids resolve to the full record when the map
+    has it.
+
+    With a `mirror`, tables are synced into the local SQLite mirror and read
+    from it, and the queries the mirror can express are answered from its
+    indexes instead of Airtable.
+    """
+
+    def __init__(self, writer=None, mirror=None):
+        self.writer = writer
+        self.mirror = mirror
+        self._lock = threading.Lock()
+        self._records = {}
+        self._complete = set()
+        self._queries = {}
+        self._projected = {}
+        self._loaded = []
+        self._loaded_at = None
+        self._refreshes = 0
+
+    @staticmethod
+    def _build_formula(record_cls, record_filter):
+        if record_filter is None:
+            return ""
+        return record_filter.build_formula(record_cls)
+
+    def _table(self, record_cls):
+        return self._records.setdefault(record_cls, {})
+
+    def _identity(self, record_cls, record, replace=False):
+        with self._lock:
+            table = self._table(record_cls)
+            existing = table.get(record.id)
+            if existing is None:
+                table[record.id] = record
+                return record
+            if replace and existing is not record:
+                existing._fields_values = record._fields_values
+                existing._orig_fields_values = record._orig_fields_values
+                existing._created_timestamp = record._created_timestamp
+            return existing
+
+    def _list_records(self, record_cls, record_filter, query=None):
+        return super().list_records(
+            record_cls=record_cls,
+            base_and_table=query or record_cls.objects.all(),
+            record_filter=record_filter,
+        )
+
+    def _sync(self, record_cls):
+        """Sync the table into the mirror, returns (changed records, deleted ids).
+
+        If Airtable cannot be reached the table is read from the mirror as it
+        was last synced.
+        """
+        try:
+            return self.mirror.sync(
+                record_cls, functools.partial(self._list_records, record_cls)
+            )
+        except Exception as e:
+            if not self.mirror.has(record_cls):
+                raise
+            print(
+                f"Syncing {record_cls.get_class_table_id()} failed,"
+                f" using the mirror: {e}",
+                file=sys.stderr,
+            )
+            self.mirror.tables.add(record_cls)
+            return [], set()
+
+    @staticmethod
+    def _from_mirror(record_cls, records_data):
+        for record_data in records_data:
+            record = record_cls(
+                _base_id=record_cls.get_class_base_id(),
+                _table_id=record_cls.get_class_table_id(),
+            )
+            record.consume_airtable_data(record_data)
+            yield record
+
+    def _load_mirrored(self, query):
+        """load() a query through the mirror, False if SQL cannot express it."""
+        if isinstance(query, RecordQuery):
+            record_cls, record_filter = query._record_class, query._filter
+        else:
+            record_cls, record_filter = query, None
+        fields = getattr(query, "fields", None)
+
+        changed, deleted = self._sync(record_cls)
+        if record_filter is None and record_cls in self._complete:
+            # Only the changes, the rest of the table is already in memory
+            records_data = changed
+        else:
+            try:
+                records_data = self.mirror.select(record_cls, record_filter)
+            except ValueError:
+                return False
+
+        records = [
+            self._identity(record_cls, record, replace=True)
+            for record in self._from_mirror(record_cls, records_data)
+        ]
+        with self._lock:
+            table = self._table(record_cls)
+            for record_id in deleted:
+                table.pop(record_id, None)
+            self._invalidate_queries(record_cls)
+            if record_filter is None:
+                if record_cls not in self._complete:
+                    ids = {record.id for record in records}
+                    for record_id in [
+                        record_id for record_id in table if record_id not in ids
+                    ]:
+                        del table[record_id]
+                    self._complete.add(record_cls)
+                self._queries[(record_cls, "")] = list(table)
+                return True
+
+            formula = self._build_formula(record_cls, record_filter)
+            self._queries[(record_cls, formula)] = [record.id for record in records]
+            if fields is not None:
+                self._projected[(record_cls, formula, fields)] = records
+        return True
+
+    def _load_query(self, query):
+        if self.mirror is not None and self._load_mirrored(query):
+            return
+
+        fields = getattr(query, "fields", None)
+        if fields is not None:
+            record_cls = query._record_class
+            formula = self._build_formula(record_cls, query._filter)
+            records = list(
+                super().fetch_many(
+                    record_cls=record_cls,
+                    base_and_table=query,
+                    record_filter=query._filter,
+                )
+            )
+            with self._lock:
+                self._projected[(record_cls, formula, fields)] = records
+            return
+
+        if isinstance(query, RecordQuery):
+            record_cls = query._record_class
+            record_filter = query._filter
+        else:
+            record_cls = query
+            query = record_cls.objects.all()
+            record_filter = None
+
+        records = [
+            self._identity(record_cls, record, replace=True)
+            for record in super().fetch_many(
+                record_cls=record_cls, base_and_table=query, record_filter=record_filter
+            )
+        ]
+        with self._lock:
+            if record_filter is None:
+                ids = {record.id for record in records}
+                table = self._table(record_cls)
+                for record_id in [
+                    record_id for record_id in table if record_id not in ids
+                ]:
+                    del table[record_id]
+                self._complete.add(record_cls)
+            self._queries[
+                (record_cls, self._build_formula(record_cls, record_filter))
+            ] = [record.id for record in records]
+
+    def _refresh_filtered(self, query, since):
+        """Apply the changes since `since` to a loaded filtered query.
+
+        The records modified since are listed with the fields the filter
+        reads, which is then evaluated locally. Returns False when the query
+        has to be listed again: not loaded anymore or a filter _matches
+        cannot evaluate.
+        """
+        record_cls, record_filter = query._record_class, query._filter
+        fields = getattr(query, "fields", None)
+        formula = self._build_formula(record_cls, record_filter)
+        with self._lock:
+            if fields is not None:
+                loaded = self._projected.get((record_cls, formula, fields))
+            else:
+                loaded = self._queries.get((record_cls, formula))
+        try:
+            filter_attrs = _filter_attrs(record_filter)
+        except ValueError:
+            return False
+        if loaded is None:
+            return False
+
+        if fields is None:
+            deferred = record_cls._get_meta_attr("deferred_fields", ())
+            listed = [
+                name for name, _ in record_cls.iter_fields() if name not in deferred
+            ]
+        else:
+            listed = list(fields)
+        listed += [name for name in filter_attrs if name not in listed]
+        changes = {}
+        for record_data in self._list_records(
+            record_cls, modified_since(since), record_cls.objects.all().only(*listed)
+        ):
+            record = record_cls(
+                _base_id=record_cls.get_class_base_id(),
+                _table_id=record_cls.get_class_table_id(),
+            )
+            record.consume_airtable_data(record_data)
+            matched = _matches(record_cls, record_filter, record_data.get("fields", {}))
+            if fields is None:
+                record = self._identity(record_cls, record, replace=True)
+            else:
+                record._projection = fields
+            changes[record.id] = record if matched else None
+
+        with self._lock:
+            table = self._table(record_cls)
+            if fields is None:
+                records = {record_id: table.get(record_id) for record_id in loaded}
+            else:
+                records = {record.id: record for record in loaded}
+            for record_id, record in changes.items():
+                records.pop(record_id, None)
+                if record is not None:
+                    records[record_id] = record
+            # In Airtable's creation order, as a listing would return them
+            ordered = sorted(
+                (record for record in records.values() if record is not None),
+                key=lambda record: (record.created_timestamp, record.id),
+            )
+            if fields is not None:
+                self._projected[(record_cls, formula, fields)] = ordered
+            else:
+                self._queries[(record_cls, formula)] = [r.id for r in ordered]
+        return True
+
+    def _refresh_query(self, query, since):
+        if isinstance(query, RecordQuery):
+            if not self._refresh_filtered(query, since):
+                self._load_query(query)
+            return
+
+        record_cls = query
+        query = record_cls.objects.all()
+        for record in super().fetch_many(
+            record_cls=record_cls,
+            base_and_table=query,
+            record_filter=modified_since(since),
+        ):
+            self._identity(record_cls, record, replace=True)
+
+    def _run(self, target, args_list):
+        threads = []
+        for args in args_list:
+            t = threading.Thread(target=target, args=args)
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+
+    def load(self, queries):
+        """Bulk load record classes (whole tables) or filtered record queries."""
+        started = datetime.datetime.utcnow()
+        for query in queries:
+            if query not in self._loaded:
+                self._loaded.append(query)
+        self._run(self._load_query, [(query,) for query in queries])
+        self._loaded_at = started
+
+    def refresh(self):
+        """Bring the loaded tables up to date.
+
+        Whole tables and filtered queries only fetch the records modified
+        since the previous refresh, filtered queries evaluate their filter on
+        them locally.
+        """
+        self._refreshes += 1
+        if self.mirror is not None:
+            # The mirror pulls the changes and reconciles deletions itself
+            self.load(self._loaded)
+            return
+        if self._loaded_at is None or self._refreshes % RECONCILE_EVERY == 0:
+            self.load(self._loaded)
+            return
+
+        started = datetime.datetime.utcnow()
+        since = self._loaded_at - REFRESH_OVERLAP
+        self._run(self._refresh_query, [(query, since) for query in self._loaded])
+        self._loaded_at = started
+
+    def get(self, record_cls, record_id, default=None):
+        with self._lock:
+            return self._table(record_cls).get(record_id, default)
+
+    def fetch_single(self, *, record_cls, record_id, base_and_table):
+        record = self.get(record_cls, record_id)
+        if record is not None:
+            return record
+
+        if self.mirror is not None and record_cls in self.mirror.tables:
+            record_data = self.mirror.get(record_cls, record_id)
+            if record_data is not None:
+                record = next(self._from_mirror(record_cls, [record_data]))
+                return self._identity(record_cls, record)
+
+        record = super().fetch_single(
+            record_cls=record_cls, record_id=record_id, base_and_table=base_and_table
+        )
+        return self._identity(record_cls, record)
+
+    def fetch_many(self, *, record_cls, base_and_table, record_filter=None):
+        fields = getattr(base_and_table, "fields", None)
+        formula = self._build_formula(record_cls, record_filter)
+        with self._lock:
+            table = self._table(record_cls)
+            if not formula and record_cls in self._complete:
+                records = list(table.values())
+            elif fields is not None:
+                records = self._projected.get((record_cls, formula, fields))
+                if records is not None:
+                    records = [table.get(record.id, record) for record in records]
+            elif (record_cls, formula) in self._queries:
+                records = [
+                    table[record_id]
+                    for record_id in self._queries[(record_cls, formula)]
+                    if record_id in table
+                ]
+            else:
+                records = None
+
+        if records is not None:
+            yield from records
+            return
+
+        if self.mirror is not None and record_cls in self.mirror.tables:
+            try:
+                records_data = self.mirror.select(record_cls, record_filter)
+            except ValueError:
+                pass
+            else:
+                for record in self._from_mirror(record_cls, records_data):
+                    yield self._identity(record_cls, record)
+                return
+
+        for record in super().fetch_many(
+            record_cls=record_cls,
+            base_and_table=base_and_table,
+            record_filter=record_filter,
+        ):
+            if record._projection is None:
+                yield self._identity(record_cls, record)
+            else:
+                yield self.get(record_cls, record.id, record)
+
+    def _invalidate_queries(self, record_cls):
+        for key in [key for key in self._queries if key[0] is record_cls]:
+            if key[1]:
+                del self._queries[key]
+        for key in [key for key in self._projected if key[0] is record_cls]:
+            if key[1]:
+                del self._projected[key]
+
+    def _store(self, record_cls, record):
+        if self.mirror is not None and record_cls in self.mirror.tables:
+            if record._projection is None:
+                self.mirror.store(record_cls, record)
+        if record._projection is not None:
+            with self._lock:
+                self._invalidate_queries(record_cls)
+            return
+        with self._lock:
+            self._table(record_cls)[record.id] = record
+            self._invalidate_queries(record_cls)
+
+    def save(self, record_cls, record):
+        if self.writer is not None:
+            self.writer.add(record_cls, record)
+            if record.id is not None:
+                self._store(record_cls, record)
+            return
+
+        super().save(record_cls, record)
+        self._store(record_cls, record)
+
+    def flush(self):
+        """Write the saves queued in the write-behind writer."""
+        if self.writer is None:
+            return
+        for record in self.writer.flush():
+            self._store(type(record), record)
+
+    def delete_id(self, *, record_cls, record_id, base_and_table):
+        super().delete_id(
+            record_cls=record_cls, record_id=record_id, base_and_table=base_and_table
+        )
+        if self.mirror is not None:
+            self.mirror.delete(record_cls, record_id)
+        with self._lock:
+            self._table(record_cls).pop(record_id, None)
+            self._invalidate_queries(record_cls)
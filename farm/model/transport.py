@@ -0,0 +1,163 @@
+import os
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from pyrtable.exceptions import RequestError
+
+from ..metrics import metrics
+
+# Airtable allows 5 requests per second per base
+REQUESTS_PER_SECOND = float(os.getenv("AIRTABLE_REQUESTS_PER_SECOND", 5))
+BURST = int(os.getenv("AIRTABLE_BURST", 5))
+MAX_RETRIES = int(os.getenv("AIRTABLE_MAX_RETRIES", 5))
+# Airtable locks a base out for 30 seconds after a 429
+PENALTY_SECONDS = float(os.getenv("AIRTABLE_PENALTY_SECONDS", 30))
+
+
+def check_response(response):
+    if 400 <= response.status_code < 500:
+        error = response.json().get("error", {})
+        if not isinstance(error, dict):
+            error = {"type": error}
+        error_message = error.get("message", "")
+        error_type = error.get("type", "")
+
+        raise RequestError(message=error_message, type=error_type)
+    response.raise_for_status()
+
+
+class Pacer:
+    """Token bucket for one base, slowed down by every 429.
+
+    The rate is halved on a 429 and all requests wait out the penalty, it
+    then grows back by a tenth of the ceiling per successful request.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    elapsed = now - self.updated
+                    self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def throttled(self, penalty):
+        with self._lock:
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + penalty)
+            self.updated = self.blocked_until
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class Transport:
+    """Shared HTTP transport for every Airtable request.
+
+    Requests are paced per base and retried after 429s, and concurrent GETs
+    of the same URL are sent once, every caller gets the same response.
+    """
+
+    def __init__(
+        self,
+        rate=REQUESTS_PER_SECOND,
+        burst=BURST,
+        max_retries=MAX_RETRIES,
+        penalty=PENALTY_SECONDS,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.penalty = penalty
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=16))
+        self._pacers = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def pacer(self, base_id):
+        with self._lock:
+            pacer = self._pacers.get(base_id)
+            if pacer is None:
+                pacer = Pacer(self.rate, self.burst)
+                self._pacers[base_id] = pacer
+            return pacer
+
+    def __send(self, method, url, base_id, headers, data):
+        pacer = self.pacer(base_id)
+        for attempt in range(self.max_retries + 1):
+            pacer.acquire()
+            response = self.session.request(method, url, headers=headers, data=data)
+            metrics.count("airtable", nbytes=len(data or "") + len(response.content))
+            if response.status_code != 429:
+                pacer.succeeded()
+                return response
+
+            penalty = float(response.headers.get("Retry-After", self.penalty))
+            print(
+                f"Airtable rate limit on {base_id}, waiting {penalty}s",
+                file=sys.stderr,
+            )
+            pacer.throttled(penalty)
+        return response
+
+    def request(self, method, url, *, base_id, headers=None, data=None):
+        if method != "GET":
+            return self.__send(method, url, base_id, headers, data)
+
+        key = (url, (headers or {}).get("Authorization"))
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self.__send(method, url, base_id, headers, data)
+            return call.response
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+
+transport = Transport()
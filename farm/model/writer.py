@@ -0,0 +1,275 @@
+import importlib
+import json
+import os
+import sys
+import threading
+
+import requests
+from pyrtable.exceptions import RequestError
+
+from .transport import check_response, transport
+
+BATCH_SIZE = 10
+
+
+def _class_path(record_cls):
+    return f"{record_cls.__module__}.{record_cls.__qualname__}"
+
+
+def _import_class(path):
+    module_name, class_name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class Rejected(Exception):
+    """Airtable refused the batch (4xx but 429), sending it again cannot help."""
+
+
+def _retryable(error):
+    """Transport errors, 5xx and 429s: the batch can be sent again later."""
+    return isinstance(error, (requests.RequestException, RequestError))
+
+
+def _split(batch):
+    half = len(batch["records"]) // 2
+    objects = batch.get("objects", [])
+    return [
+        {**batch, "records": batch["records"][:half], "objects": objects[:half]},
+        {**batch, "records": batch["records"][half:], "objects": objects[half:]},
+    ]
+
+
+def _send(record_cls, method, url, base_id, records):
+    headers = record_cls.get_request_headers(
+        {"Content-Type": "application/json"}, base_id=base_id
+    )
+    response = transport.request(
+        method,
+        url,
+        base_id=base_id,
+        headers=headers,
+        data=json.dumps({"records": records}),
+    )
+    try:
+        check_response(response)
+    except RequestError as e:
+        if response.status_code == 429:
+            raise
+        raise Rejected(f"{response.status_code} {e}") from e
+    return response.json()["records"]
+
+
+class BatchWriter:
+    """Write-behind queue for record saves.
+
+    Saved records are only marked dirty; flush() sends them as multi-record
+    POST/PATCH requests of up to BATCH_SIZE records, so a record saved several
+    times during a cycle costs a single write. Batches are written to a
+    journal before being sent and replayed on the next start if the process
+    dies mid-flush. New records are journaled as soon as they are saved: a
+    print record must not be lost when the process dies before the flush,
+    or the file would be printed again. Airtable writes a batch entirely or not at all, a rejected
+    batch is split down to the records at fault, which are logged and
+    dropped.
+    """
+
+    def __init__(self, journal_path=None):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._pending = {}
+        # Journal batches replay() could not send, sent again by flush()
+        self._unsent = []
+
+    def add(self, record_cls, record):
+        with self._lock:
+            new = id(record) not in self._pending
+            self._pending[id(record)] = (record_cls, record)
+        if new and record.id is None:
+            self.__journal_create(record_cls, record)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __build_batches(self, pending):
+        grouped = {}
+        for record_cls, record in pending:
+            fields = record.encode_to_airtable()
+            if record.id is None:
+                method, payload = "POST", {"fields": fields}
+            elif fields:
+                method, payload = "PATCH", {"id": record.id, "fields": fields}
+            else:
+                continue
+            key = (record_cls, method, record.build_url(), record.base_id)
+            grouped.setdefault(key, []).append((record, payload))
+
+        batches = []
+        for (record_cls, method, url, base_id), items in grouped.items():
+            for i in range(0, len(items), BATCH_SIZE):
+                chunk = items[i : i + BATCH_SIZE]
+                batches.append(
+                    {
+                        "class": _class_path(record_cls),
+                        "method": method,
+                        "url": url,
+                        "base_id": base_id,
+                        "records": [payload for _, payload in chunk],
+                        "objects": [record for record, _ in chunk],
+                    }
+                )
+        return batches
+
+    @staticmethod
+    def _entry(batch):
+        return json.dumps({k: v for k, v in batch.items() if k != "objects"}) + "\n"
+
+    def __journal_create(self, record_cls, record):
+        if not self.journal_path:
+            return
+        with self._journal_lock:
+            with open(self.journal_path, "a") as f:
+                for batch in self.__build_batches([(record_cls, record)]):
+                    f.write(self._entry(batch))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def __write_journal(self, batches):
+        """Journal the batches left to send and the records created since."""
+        if not self.journal_path:
+            return
+        with self._journal_lock:
+            sending = {
+                id(record) for batch in batches for record in batch.get("objects", [])
+            }
+            with self._lock:
+                created = [
+                    (record_cls, record)
+                    for record_cls, record in self._pending.values()
+                    if record.id is None and id(record) not in sending
+                ]
+            batches = batches + self.__build_batches(created)
+            if not batches:
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+                return
+
+            tmp_path = f"{self.journal_path}.tmp"
+            with open(tmp_path, "w") as f:
+                for batch in batches:
+                    f.write(self._entry(batch))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+
+    def __send_batch(self, batch):
+        record_cls = _import_class(batch["class"])
+        data = _send(
+            record_cls,
+            batch["method"],
+            batch["url"],
+            batch["base_id"],
+            batch["records"],
+        )
+        for record, record_data in zip(batch.get("objects", []), data):
+            if batch["method"] == "POST":
+                record.consume_airtable_data(record_data)
+            else:
+                record._clear_dirty_fields()
+
+    def __send_first(self, batches):
+        """Send batches[0] and drop it from the journal, returns its records.
+
+        A rejected batch is replaced by its two halves, a single rejected
+        record is logged and dropped.
+        """
+        batch = batches.pop(0)
+        try:
+            self.__send_batch(batch)
+        except Rejected as e:
+            if len(batch["records"]) > 1:
+                batches[0:0] = _split(batch)
+            else:
+                print(
+                    f"Airtable rejected {batch['method']} {batch['url']}"
+                    f" {json.dumps(batch['records'][0])}: {e}",
+                    file=sys.stderr,
+                )
+            self.__write_journal(batches)
+            return []
+        except Exception:
+            batches.insert(0, batch)
+            raise
+        self.__write_journal(batches)
+        return batch.get("objects", [])
+
+    def flush(self):
+        """Send every pending save, returns the records that were written."""
+        with self._flush_lock:
+            with self._lock:
+                pending = list(self._pending.values())
+                self._pending.clear()
+
+            batches = self._unsent + self.__build_batches(pending)
+            self._unsent = []
+            self.__write_journal(batches)
+
+            written = []
+            while batches:
+                try:
+                    written.extend(self.__send_first(batches))
+                except Exception:
+                    with self._lock:
+                        for batch in batches:
+                            # Batches of the journal have no record objects
+                            if not batch.get("objects"):
+                                self._unsent.append(batch)
+                            for record in batch.get("objects", []):
+                                self._pending.setdefault(
+                                    id(record), (_import_class(batch["class"]), record)
+                                )
+                    raise
+
+            return written
+
+    def replay(self):
+        """Send the batches left in the journal by an interrupted flush.
+
+        Never raises: when Airtable cannot be reached the batches are kept
+        for the next flush, entries that cannot be sent at all are dropped.
+        """
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return
+
+        with self._flush_lock:
+            batches = []
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        if line.strip():
+                            batches.append(json.loads(line))
+                    except ValueError as e:
+                        print(
+                            f"Dropping journal entry {line.strip()}: {e}",
+                            file=sys.stderr,
+                        )
+
+            while batches:
+                try:
+                    self.__send_first(batches)
+                except Exception as e:
+                    if _retryable(e):
+                        print(
+                            f"Cannot replay the Airtable journal, retrying on the"
+                            f" next flush: {e}",
+                            file=sys.stderr,
+                        )
+                        self._unsent = batches
+                        return
+                    print(
+                        f"Dropping journal entry {json.dumps(batches[0])}: {e}",
+                        file=sys.stderr,
+                    )
+                    batches.pop(0)
+                    self.__write_journal(batches)
@@ -0,0 +1,140 @@
+import bisect
+import heapq
+
+from .model.file_to_print import Priority
+
+PRIORITY_RANK = {
+    priority.name: rank
+    for rank, priority in enumerate(sorted(Priority, key=lambda p: p.name))
+}
+
+
+def parse_limits(value):
+    """Parse "name=limit,..." where name is a printer group or profile slug."""
+    limits = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, limit = item.rsplit("=", 1)
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+class PrintQueue:
+    """Files to print, ordered by priority, name and print time.
+
+    Files are partitioned by printer group, or by the printer profiles they
+    have a gcode for, and only the `limit` first files of each partition are
+    queued: a large backlog for one profile does not push the files of a
+    small group out of the queue. Partitions keep their head sorted, so
+    adding or removing a file does not rebuild the queue.
+    """
+
+    def __init__(self, files_to_print=(), limit=200, limits=None):
+        self.limit = limit
+        self.limits = limits or {}
+        self._entries = {}
+        self._partitions = {}
+        self._heads = {}
+        self._queue = None
+        for ftp in files_to_print:
+            self.add(ftp)
+
+    @staticmethod
+    def key(ftp):
+        # Ascending sort key: priority desc, name asc, print time desc, id
+        rank = PRIORITY_RANK.get(ftp.priority.name, -1) if ftp.priority else -1
+        print_time = ftp.print_model.print_time if ftp.print_model else None
+        return (-rank, ftp.name or "", -(print_time or 0), ftp.id or "")
+
+    @staticmethod
+    def partitions(ftp):
+        if ftp.printer_group:
+            return {("group", ftp.printer_group.name)}
+        if not ftp.print_model:
+            return set()
+        return {("profile", slug) for slug in ftp.print_model.get_gcodes_by_profile()}
+
+    def __limit(self, partition):
+        return self.limits.get(partition[1], self.limit)
+
+    def __head(self, partition):
+        head = self._heads.get(partition)
+        if head is None:
+            head = heapq.nsmallest(
+                self.__limit(partition),
+                (self._entries[ftp_id][0] for ftp_id in self._partitions[partition]),
+            )
+            self._heads[partition] = head
+        return head
+
+    def add(self, ftp):
+        key, partitions = self.key(ftp), self.partitions(ftp)
+        entry = self._entries.get(ftp.id)
+        if entry is not None:
+            if entry[0] == key and entry[2] == partitions:
+                # Same place in the queue, but fields like the color may differ
+                if entry[1] is not ftp:
+                    self._entries[ftp.id] = (key, ftp, partitions)
+                    self._queue = None
+                return
+            self.remove(ftp.id)
+
+        self._entries[ftp.id] = (key, ftp, partitions)
+        for partition in partitions:
+            self._partitions.setdefault(partition, set()).add(ftp.id)
+            head = self._heads.get(partition)
+            if head is None:
+                continue
+            # A limit of 0 keeps the partition out of the queue
+            if len(head) < self.__limit(partition) or (head and key < head[-1]):
+                bisect.insort(head, key)
+                del head[self.__limit(partition) :]
+        self._queue = None
+
+    def remove(self, ftp_id):
+        entry = self._entries.pop(ftp_id, None)
+        if entry is None:
+            return
+        key, _, partitions = entry
+        for partition in partitions:
+            members = self._partitions[partition]
+            members.discard(ftp_id)
+            if not members:
+                del self._partitions[partition]
+                self._heads.pop(partition, None)
+                continue
+            head = self._heads.get(partition)
+            if not head or key > head[-1]:
+                continue
+            if len(head) < self.__limit(partition):
+                # The whole partition is in its head
+                head.remove(key)
+            else:
+                # Refilled from the partition on next read
+                self._heads[partition] = None
+        self._queue = None
+
+    def sync(self, files_to_print):
+        """Update the queue to the given files, only touching what changed."""
+        files_to_print = {ftp.id: ftp for ftp in files_to_print}
+        for ftp_id in [
+            ftp_id for ftp_id in self._entries if ftp_id not in files_to_print
+        ]:
+            self.remove(ftp_id)
+        for ftp in files_to_print.values():
+            self.add(ftp)
+
+    def files(self):
+        if self._queue is None:
+            keys = set()
+            for partition in self._partitions:
+                keys.update(self.__head(partition))
+            self._queue = [self._entries[key[-1]][1] for key in sorted(keys)]
+        return self._queue
+
+    def __iter__(self):
+        return iter(self.files())
+
+    def __len__(self):
+        return len(self.files())
@@ -0,0 +1,105 @@
+import asyncio
+import sys
+import threading
+
+import aiohttp
+
+from .metrics import metrics
+from .model.aio_octoprint import AsyncOctoprint
+
+# Seconds before reconnecting a dropped socket, doubled up to the maximum
+RECONNECT_DELAY = 1
+RECONNECT_DELAY_MAX = 30
+
+
+class PushListener:
+    """Printer states pushed by OctoPrint over its SockJS websocket.
+
+    Every watched printer keeps a socket open from the farm's EventLoop.
+    The latest state text is kept by printer record id and `changed` is set
+    whenever one changes, the transitions themselves are applied by the farm
+    through Printer.update_status. A printer whose socket is down is not
+    live and gets polled instead.
+    """
+
+    def __init__(self, event_loop, changed=None):
+        self.changed = changed or threading.Event()
+        self._states = {}
+        self._live = set()
+        self._follows = {}
+        self._lock = threading.Lock()
+        self._event_loop = event_loop
+
+    def stop(self):
+        for record_id in list(self._follows):
+            self.unwatch(record_id)
+
+    def watch(self, printer):
+        record = printer.record
+        if record.id in self._follows or not record.url:
+            return
+        self._follows[record.id] = self._event_loop.submit(
+            self.__follow(record.id, record.url, record.octoprint_api_key)
+        )
+
+    def unwatch(self, record_id):
+        follow = self._follows.pop(record_id, None)
+        if follow is not None:
+            follow.cancel()
+        with self._lock:
+            self._live.discard(record_id)
+            self._states.pop(record_id, None)
+
+    def is_live(self, record_id):
+        with self._lock:
+            return record_id in self._live and record_id in self._states
+
+    def state(self, record_id):
+        with self._lock:
+            return self._states.get(record_id)
+
+    def __set_state(self, record_id, state):
+        with self._lock:
+            self._live.add(record_id)
+            if self._states.get(record_id) == state:
+                return
+            self._states[record_id] = state
+        self.changed.set()
+
+    def __set_down(self, record_id):
+        with self._lock:
+            if record_id not in self._live:
+                return
+            self._live.discard(record_id)
+            self._states.pop(record_id, None)
+        # Wake the farm up, it has to poll this printer now
+        self.changed.set()
+
+    async def __follow(self, record_id, url, api_key):
+        session = self._event_loop.session()
+        octoprint = AsyncOctoprint(url=url, api_key=api_key, session=session)
+
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                auth = await octoprint.passive_login()
+                async with session.ws_connect(octoprint.push_url(), heartbeat=30) as ws:
+                    await ws.send_json({"auth": auth})
+                    delay = RECONNECT_DELAY
+                    async for message in ws:
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        metrics.count(
+                            "octoprint_push", octoprint.url, len(message.data)
+                        )
+                        current = message.json().get("current")
+                        if current:
+                            self.__set_state(record_id, current["state"]["text"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"{url} - push: {e}", file=sys.stderr)
+
+            self.__set_down(record_id)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
@@ -0,0 +1,139 @@
+import collections
+import contextlib
+import socket
+import sys
+import threading
+import time
+
+from smb.base import NotConnectedError, NotReadyError, SMBTimeout
+
+from .metrics import metrics
+
+# Errors after which a connection cannot be trusted anymore, file level
+# errors (OperationFailure) leave the session usable. The local file a
+# download writes into raises OSErrors of its own, see SMBPool.destination
+BROKEN_ERRORS = (
+    NotConnectedError,
+    NotReadyError,
+    SMBTimeout,
+    socket.error,
+)
+
+
+class Destination:
+    """File a download writes into, keeping the error it raised itself."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.error = None
+
+    def write(self, data):
+        try:
+            return self.fileobj.write(data)
+        except BaseException as e:
+            self.error = e
+            raise
+
+
+class SMBPool:
+    """Bounded pool of SMB connections to the NAS.
+
+    pysmb connections cannot be shared between threads, so every call gets a
+    connection of its own for its whole duration. Connections are opened on
+    first use, echoed before reuse when they sat idle for `health_check_after`
+    seconds, and replaced when a call breaks them.
+    """
+
+    def __init__(self, connect, size=4, health_check_after=30, retries=1):
+        self.connect = connect
+        self.size = size
+        self.health_check_after = health_check_after
+        self.retries = retries
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def __healthy(self, conn):
+        try:
+            conn.echo(b"ping", timeout=5)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.health_check_after:
+                    return conn
+                if self.__healthy(conn):
+                    return conn
+                conn.close()
+            return self.connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        if broken:
+            conn.close()
+            # The NAS probably dropped the others as well, check them first
+            with self._lock:
+                self._idle = collections.deque((c, 0) for c, _ in self._idle)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    def destination(self, fileobj):
+        """Wrap the file a download writes into, to be passed to run()."""
+        return Destination(fileobj)
+
+    @staticmethod
+    def __broken(error, destination):
+        if destination is not None and error is destination.error:
+            # A full disk or a closed pipe, the connection is fine
+            return False
+        return isinstance(error, BROKEN_ERRORS)
+
+    @contextlib.contextmanager
+    def connection(self, destination=None):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BROKEN_ERRORS as e:
+            self.release(conn, broken=self.__broken(e, destination))
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def run(self, func, retries=None, destination=None):
+        """Call func(conn), on a new connection again if the session broke.
+
+        `destination` is the wrapped file func downloads into, its own errors
+        neither break the connection nor are retried.
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            metrics.count("smb")
+            try:
+                with self.connection(destination) as conn:
+                    return func(conn)
+            except BROKEN_ERRORS as e:
+                if attempt == retries or not self.__broken(e, destination):
+                    raise
+                print(f"SMB connection lost, reconnecting: {e}", file=sys.stderr)
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            conn.close()
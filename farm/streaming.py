@@ -0,0 +1,109 @@
+import threading
+import time
+
+
+class GcodePipe:
+    """Bounded in-memory pipe between an SMB download and an upload.
+
+    The SMB side writes into it like a file, the multipart encoder reads from
+    it like a file of known length, so the upload starts with the first bytes
+    read from the NAS and at most `max_buffer` bytes are ever held in memory.
+    """
+
+    def __init__(self, size, max_buffer=4 * 1024**2):
+        self.size = size
+        self.max_buffer = max_buffer
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._done = False
+        self._error = None
+        self._closed = False
+
+    @property
+    def len(self):
+        # Read by requests_toolbelt to size the multipart body
+        return self.size - self.bytes_read
+
+    @property
+    def progress(self):
+        return self.bytes_read / self.size if self.size else 1.0
+
+    @property
+    def throughput(self):
+        """Bytes per second handed to the upload so far."""
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.bytes_read / elapsed if elapsed > 0 else 0.0
+
+    def write(self, data):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._closed or len(self._buffer) < self.max_buffer
+            )
+            if self._closed:
+                raise BrokenPipeError("Upload side of the gcode pipe was closed")
+            self._buffer.extend(data)
+            self.bytes_written += len(data)
+            self._cond.notify_all()
+        return len(data)
+
+    def finish(self, error=None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def read(self, size=-1):
+        if self.len <= 0:
+            return b""
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffer or self._done)
+            if not self._buffer:
+                if self._error is not None:
+                    raise IOError(f"Gcode download failed: {self._error}")
+                raise IOError(
+                    f"Gcode download ended after {self.bytes_written} of {self.size} bytes"
+                )
+
+            if size is None or size < 0:
+                size = len(self._buffer)
+            size = min(size, len(self._buffer), self.len)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self.bytes_read += size
+            if self.len <= 0:
+                self.finished_at = time.monotonic()
+            self._cond.notify_all()
+        return data
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._buffer.clear()
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream(size, fill, max_buffer=4 * 1024**2):
+    """Run fill(fileobj) in a thread and return the pipe it writes into."""
+    pipe = GcodePipe(size, max_buffer=max_buffer)
+
+    def produce():
+        try:
+            fill(pipe)
+        except Exception as e:
+            pipe.finish(e)
+        else:
+            pipe.finish()
+
+    threading.Thread(target=produce, daemon=True).start()
+    return pipe
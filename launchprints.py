@@ -1,17 +1,127 @@
+import argparse
 import datetime
+import os
+import signal
+import sys
+import threading
+import time
+
+# Metrics read it on import, see --profile-startup
+if "--profile-startup" in sys.argv:
+    os.environ["STARTUP_PROFILE"] = "true"
+
+started = time.perf_counter()
 from farm.farm import Farm
+from farm.metrics import metrics
 
+IMPORT_SECONDS = time.perf_counter() - started
 
-def main():
-    farm = Farm()
-    farm.launch_prints()
-    farm.launch_prints_for_printers_in_group()
 
+def print_launched_prints(farm):
     if len(farm.launched_prints) > 0:
         print(f"<{datetime.datetime.now()}> LAUNCHED PRINTS:")
         for launched_print, printfile in farm.launched_prints:
             print(f" [+] {launched_print} -> {printfile}")
+    for printer, filename, pipe in farm.transfers:
+        print(
+            f" [~] {printer} <- {filename}: {pipe.bytes_read} bytes"
+            f" at {pipe.throughput / 1024**2:.1f} MB/s"
+        )
+
+
+def launch(farm):
+    farm.launch_prints()
+    farm.launch_prints_for_printers_in_group()
+    print_launched_prints(farm)
+    farm.stage_next_prints()
+    metrics.flush()
+
+
+def print_profile():
+    print(f"{'Phase':<32} {'Count':>5} {'Seconds':>9}", file=sys.stderr)
+    for phase, (count, total, _) in metrics.phases().items():
+        print(f"{phase:<32} {count:>5} {total:>9.3f}", file=sys.stderr)
+
+
+def main():
+    metrics.start()
+    metrics.observe("import", IMPORT_SECONDS)
+    if Farm.FAST_START and not Farm.probe():
+        # Nothing to launch: keep the printer statuses and prints up to date
+        farm = Farm(poll_only=True)
+        farm.refresh_printers_async()
+        farm.close()
+        metrics.flush()
+        # A printer may have become ready while it was polled
+        if not Farm.probe():
+            return
+    farm = Farm()
+    launch(farm)
+
+
+def daemon(interval):
+    stop = threading.Event()
+    # Set on shutdown and by pushed printer state changes
+    wake = threading.Event()
+
+    def shutdown(signum, frame):
+        # Only stop between cycles, a launch in progress always completes
+        stop.set()
+        wake.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    metrics.start()
+    metrics.observe("import", IMPORT_SECONDS)
+    farm = Farm()
+    if Farm.OCTOPRINT_PUSH:
+        farm.start_push(wake)
+
+    while not stop.is_set():
+        try:
+            launch(farm)
+        except Exception as e:
+            print(e, file=sys.stderr)
+
+        while True:
+            wake.wait(interval)
+            wake.clear()
+            if stop.is_set():
+                break
+            try:
+                farm.refresh()
+                break
+            except Exception as e:
+                print(e, file=sys.stderr)
+
+    farm.close()
+    metrics.stop()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep the farm running and launch prints on every tick",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=float(os.getenv("FARM_TICK_SECONDS", 5)),
+        help="seconds between two cycles in daemon mode",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print the time spent in each phase to stderr",
+    )
+    args = parser.parse_args()
+
+    if args.daemon:
+        daemon(args.interval)
+    else:
+        main()
+    if args.profile_startup:
+        print_profile()